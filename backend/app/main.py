@@ -251,8 +251,9 @@ async def analyze_cxr(
         
         # Generate report
         report_generator = get_report_generator(app_settings.ai, app_settings.llm)
-        report = await report_generator.generate_report(findings)
-        triage_level, triage_reasons = report_generator.determine_triage(findings)
+        categories = report_generator.categorize_findings(findings)
+        report = await report_generator.generate_report(findings, categories)
+        triage_level, triage_reasons = report_generator.determine_triage(findings, categories)
         
         # Update study
         study.status = "completed"
@@ -1,6 +1,8 @@
 """
 Report generation service with deterministic templates and optional LLM rewriting.
 """
+import sys
+from types import MappingProxyType
 from typing import List, Optional, Tuple
 from app.schemas import FindingResult, ReportResult
 from app.config import LLMSettings, AISettings
@@ -8,7 +10,7 @@ from app.services.llm_service import LLMService, get_llm_service
 
 
 # Finding templates based on status and confidence
-FINDING_TEMPLATES = {
+_FINDING_TEMPLATES = {
     "pneumothorax": {
         "POSITIVE_STRONG": "There is evidence of pneumothorax.",
         "POSITIVE": "Findings suggestive of pneumothorax. Clinical correlation recommended.",
@@ -67,12 +69,25 @@ FINDING_TEMPLATES = {
     },
 }
 
-IMPRESSION_TEMPLATES = {
+# Read-only views with interned keys for the report hot path
+FINDING_TEMPLATES = MappingProxyType({
+    sys.intern(name): MappingProxyType({sys.intern(k): v for k, v in templates.items()})
+    for name, templates in _FINDING_TEMPLATES.items()
+})
+
+IMPRESSION_TEMPLATES = MappingProxyType({
     "URGENT": "URGENT: {urgent_findings}. Immediate clinical attention recommended.",
     "ROUTINE": "Abnormal chest radiograph with {routine_findings}. Clinical correlation recommended.",
     "NORMAL": "No acute cardiopulmonary abnormality identified.",
     "UNCERTAIN": "Limited examination with equivocal findings. Radiologist review recommended. {uncertain_findings}",
-}
+})
+
+_NO_TEMPLATES = MappingProxyType({})
+
+NO_FINDINGS_TEXT = "No significant abnormalities identified."
+
+# (urgent, routine, uncertain, negative) finding names
+FindingCategories = Tuple[List[str], List[str], List[str], List[str]]
 
 DISCLAIMER = "AI assistance only. Not for standalone diagnosis. All findings require radiologist review."
 
@@ -104,7 +119,7 @@ class ReportGenerator:
     def _generate_finding_text(self, finding: FindingResult) -> str:
         """Generate text for a single finding."""
         finding_name = finding.finding_name.lower().replace(" ", "_")
-        templates = FINDING_TEMPLATES.get(finding_name, {})
+        templates = FINDING_TEMPLATES.get(finding_name, _NO_TEMPLATES)
         
         status_key = self._get_finding_status_key(finding)
         template = templates.get(status_key)
@@ -122,7 +137,7 @@ class ReportGenerator:
         
         return template
     
-    def _categorize_findings(self, findings: List[FindingResult]) -> Tuple[List[str], List[str], List[str], List[str]]:
+    def categorize_findings(self, findings: List[FindingResult]) -> FindingCategories:
         """Categorize findings into urgent, routine, uncertain, and negative."""
         urgent = []
         routine = []
@@ -147,9 +162,9 @@ class ReportGenerator:
         
         return urgent, routine, uncertain, negative
     
-    def _generate_impression(self, findings: List[FindingResult]) -> Tuple[str, str]:
+    def _generate_impression(self, categories: FindingCategories) -> Tuple[str, str]:
         """Generate impression text and determine triage level."""
-        urgent, routine, uncertain, negative = self._categorize_findings(findings)
+        urgent, routine, uncertain, negative = categories
         
         if urgent:
             triage_level = "URGENT"
@@ -172,8 +187,17 @@ class ReportGenerator:
         
         return impression, triage_level
     
-    async def generate_report(self, findings: List[FindingResult]) -> ReportResult:
-        """Generate a complete report from findings."""
+    async def generate_report(
+        self,
+        findings: List[FindingResult],
+        categories: Optional[FindingCategories] = None
+    ) -> ReportResult:
+        """
+        Generate a complete report from findings.
+        
+        Pass ``categories`` from categorize_findings() to reuse a
+        categorization already computed for this request.
+        """
         # Generate findings section
         findings_texts = []
         finding_names = []
@@ -187,12 +211,14 @@ class ReportGenerator:
             findings_texts.append(text)
             finding_names.append(finding.finding_name)
         
-        findings_text = " ".join(findings_texts) if findings_texts else "No significant abnormalities identified."
+        findings_text = " ".join(findings_texts) if findings_texts else NO_FINDINGS_TEXT
         
         # Generate impression
-        impression_text, _ = self._generate_impression(findings)
+        if categories is None:
+            categories = self.categorize_findings(findings)
+        impression_text, _ = self._generate_impression(categories)
         
-        # Combine into template
+        # Combine into template (a single f-string builds it in one allocation)
         template_report = f"FINDINGS:\n{findings_text}\n\nIMPRESSION:\n{impression_text}"
         
         # Try LLM rewrite if enabled
@@ -218,9 +244,15 @@ class ReportGenerator:
             disclaimer=DISCLAIMER
         )
     
-    def determine_triage(self, findings: List[FindingResult]) -> Tuple[str, List[str]]:
+    def determine_triage(
+        self,
+        findings: List[FindingResult],
+        categories: Optional[FindingCategories] = None
+    ) -> Tuple[str, List[str]]:
         """Determine triage level and reasons from findings."""
-        urgent, routine, uncertain, _ = self._categorize_findings(findings)
+        if categories is None:
+            categories = self.categorize_findings(findings)
+        urgent, routine, uncertain, _ = categories
         
         reasons = []
         
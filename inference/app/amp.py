@@ -0,0 +1,28 @@
+"""
+Mixed precision helpers shared by the models.
+"""
+import torch
+
+
+def cpu_has_native_bf16() -> bool:
+    """Whether oneDNN has BF16 kernels for this CPU; elsewhere CPU autocast only adds casts."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def amp_supported(device: str) -> bool:
+    """Whether autocast is worth enabling on ``device``."""
+    return str(device).startswith("cuda") or cpu_has_native_bf16()
+
+
+def autocast(device: str, enabled: bool = True, cache_enabled: bool = True) -> torch.autocast:
+    """Autocast context for ``device``: FP16 on CUDA, BF16 on CPU."""
+    is_cuda = str(device).startswith("cuda")
+    return torch.autocast(
+        device_type="cuda" if is_cuda else "cpu",
+        dtype=torch.float16 if is_cuda else torch.bfloat16,
+        enabled=enabled,
+        cache_enabled=cache_enabled
+    )
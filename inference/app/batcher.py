@@ -0,0 +1,152 @@
+"""
+Micro-batching for concurrent inference requests.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def bucket_sizes(max_batch: int) -> List[int]:
+    """
+    Batch sizes for models that only run fixed shapes (compiled or CUDA-graphed).
+    
+    Powers of two up to ``max_batch``, largest first; any batch up to
+    ``max_batch`` splits into a few chunks of these sizes.
+    """
+    sizes = []
+    size = 1
+    while size <= max(1, max_batch):
+        sizes.append(size)
+        size *= 2
+    return sizes[::-1]
+
+
+def split_batch(n: int, sizes: List[int]) -> List[int]:
+    """Split a batch of ``n`` into chunk sizes taken from ``sizes`` (largest first)."""
+    chunks = []
+    for size in sizes:
+        while n >= size:
+            chunks.append(size)
+            n -= size
+    return chunks
+
+
+class InferenceBatcher:
+    """
+    Coalesces concurrent single-image requests into batched model calls.
+    
+    Requests wait at most ``max_wait_ms`` for others to arrive, up to
+    ``max_batch`` images per forward pass. Requests submitted with different
+    keyword options are run as separate batches.
+    
+    ``predict_batch`` may return an exception in place of a result to fail
+    just that request. If it raises, the batch is rerun one item at a time
+    so only the requests that fail on their own see the error.
+    
+    Batches run on a single thread owned by the batcher. torch.compile's
+    CUDA graph trees keep their state per thread, so anything that warms
+    up the model should go through ``run_in_thread`` as well.
+    """
+    
+    def __init__(
+        self,
+        predict_batch: Callable[..., List[Any]],
+        max_batch: int = 16,
+        max_wait_ms: float = 10.0
+    ):
+        """
+        Args:
+            predict_batch: Callable taking a list of images plus keyword
+                options and returning one result per image
+            max_batch: Maximum number of images per batch
+            max_wait_ms: Maximum time to wait for a batch to fill
+        """
+        self.predict_batch = predict_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+    
+    def start(self):
+        """Start the background batching task on the running event loop."""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background batching task."""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        self._executor.shutdown(wait=False)
+    
+    async def run_in_thread(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run ``func`` on the batcher's inference thread and wait for it."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+    
+    async def submit(self, item: Any, **kwargs) -> Any:
+        """Queue one image and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, kwargs, future))
+        return await future
+    
+    async def _run(self):
+        """Drain the queue into batches until cancelled."""
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Requests with different options can't share a forward pass
+            groups: Dict[Tuple, List] = {}
+            for entry in batch:
+                groups.setdefault(tuple(sorted(entry[1].items())), []).append(entry)
+            
+            for entries in groups.values():
+                await self._dispatch(entries)
+    
+    async def _dispatch(self, entries: List[Tuple[Any, Dict, asyncio.Future]]):
+        """Run one batch off the event loop and resolve its futures."""
+        items = [item for item, _, _ in entries]
+        kwargs = entries[0][1]
+        
+        try:
+            results = await self.run_in_thread(self.predict_batch, items, **kwargs)
+        except Exception as e:
+            if len(entries) == 1:
+                results = [e]
+            else:
+                # Don't let one bad request fail the others it was batched with
+                for entry in entries:
+                    await self._dispatch([entry])
+                return
+        
+        if len(results) != len(items):
+            # Never leave a request waiting on a result that won't come
+            error = RuntimeError(
+                f"predict_batch returned {len(results)} results for {len(items)} inputs"
+            )
+            results = [error] * len(items)
+        
+        for (_, _, future), result in zip(entries, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
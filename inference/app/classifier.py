@@ -3,15 +3,20 @@ CXR Classification model using TorchXRayVision.
 Real pretrained model with calibration support.
 """
 import os
+import sys
 import json
+import functools
+import threading
 import numpy as np
-from typing import Dict, List, Optional, Tuple
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
 from pathlib import Path
 
 import torch
 import torch.nn.functional as F
 import torchvision.transforms as transforms
 from PIL import Image
+from scipy.special import expit, logit
 
 try:
     import torchxrayvision as xrv
@@ -20,7 +25,31 @@ except ImportError:
     TORCHXRAYVISION_AVAILABLE = False
     print("Warning: torchxrayvision not available")
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 from app.config import settings, CLASSIFIER_CONFIG, FINDING_MAPPING
+from app.amp import amp_supported, autocast
+from app.batcher import bucket_sizes, split_batch
+from app.onnx_utils import ONNXRUNTIME_AVAILABLE, weights_digest, export_onnx, create_session
+
+
+@functools.lru_cache(maxsize=8)
+def _read_calibration(path: str, mtime: float) -> Dict:
+    """
+    Read and parse a calibration file.
+    
+    Cached on (path, mtime) so repeated loads skip the parse until the
+    file changes. Callers must treat the returned dict as read-only.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    if ORJSON_AVAILABLE:
+        return orjson.loads(raw)
+    return json.loads(raw)
 
 
 class TemperatureScaling:
@@ -45,31 +74,26 @@ class IsotonicCalibrator:
             calibration_map: Dict mapping finding names to list of (raw_prob, calibrated_prob) tuples
         """
         self.calibration_map = calibration_map
+        
+        # Sort each map once and keep it as arrays for np.interp
+        self._curves: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        for finding, points in calibration_map.items():
+            if not points:
+                continue
+            points = sorted(points, key=lambda x: x[0])
+            xs = np.array([p[0] for p in points], dtype=np.float64)
+            ys = np.array([p[1] for p in points], dtype=np.float64)
+            self._curves[finding] = (xs, ys)
     
     def calibrate(self, finding: str, probability: float) -> float:
         """Calibrate a single probability."""
-        if finding not in self.calibration_map:
-            return probability
-        
-        points = self.calibration_map[finding]
-        if not points:
+        curve = self._curves.get(finding)
+        if curve is None:
             return probability
         
-        # Linear interpolation
-        points = sorted(points, key=lambda x: x[0])
-        
-        if probability <= points[0][0]:
-            return points[0][1]
-        if probability >= points[-1][0]:
-            return points[-1][1]
-        
-        for i in range(len(points) - 1):
-            if points[i][0] <= probability <= points[i + 1][0]:
-                # Linear interpolation
-                t = (probability - points[i][0]) / (points[i + 1][0] - points[i][0])
-                return points[i][1] + t * (points[i + 1][1] - points[i][1])
-        
-        return probability
+        # Linear interpolation, clamped to the end points
+        xs, ys = curve
+        return float(np.interp(probability, xs, ys))
 
 
 class CXRClassifier:
@@ -83,8 +107,17 @@ class CXRClassifier:
         self.model = None
         self.transform = None
         self.calibrator = None
+        self.session = None
+        self._output_slots: List[Tuple[int, str]] = []
+        self._graphs: Dict[int, Tuple[torch.cuda.CUDAGraph, torch.Tensor, torch.Tensor]] = {}
+        self._op_norm = None
+        self._gpu_preprocess = False  # Set when GPU preprocessing matches XRV's resize
+        # Mixed precision; switched off for good if it ever fails on this model
+        self._use_amp = settings.use_amp and amp_supported(self.device)
+        self._graph_lock = threading.Lock()
         self.config = CLASSIFIER_CONFIG.get(settings.classifier_model, {})
         self.loaded = False
+        self._info = MappingProxyType(self._build_info())
         
     def load(self) -> bool:
         """Load the model and calibration."""
@@ -101,16 +134,37 @@ class CXRClassifier:
             self.model = self.model.to(self.device)
             self.model.eval()
             
+            # Precompute which model outputs map to our findings
+            self._output_slots = [
+                (i, FINDING_MAPPING[pathology])
+                for i, pathology in enumerate(self.model.pathologies)
+                if pathology in FINDING_MAPPING
+            ]
+            
             # Setup transforms - TorchXRayVision expects specific preprocessing
             self.transform = transforms.Compose([
                 xrv.datasets.XRayCenterCrop(),
                 xrv.datasets.XRayResizer(224)
             ])
             
+            # Prefer ONNX Runtime; fall back to PyTorch if it is unavailable
+            if settings.use_onnx and ONNXRUNTIME_AVAILABLE:
+                try:
+                    self.session = create_session(self.export_onnx(), self.device)
+                except Exception as e:
+                    print(f"ONNX Runtime unavailable for classifier, using PyTorch: {e}")
+                    self.session = None
+            
+            # Input shape is fixed, so capture the conv stack as CUDA graphs
+            if self._uses_gpu():
+                self._capture_graph()
+                self._gpu_preprocess = self._check_preprocess_parity()
+            
             # Load calibration if available
             self._load_calibration()
             
             self.loaded = True
+            self._info = MappingProxyType(self._build_info())
             print("Classifier loaded successfully")
             return True
             
@@ -118,14 +172,154 @@ class CXRClassifier:
             print(f"Failed to load classifier: {e}")
             return False
     
+    def export_onnx(self) -> Path:
+        """Export the classifier to ONNX, cached on disk by weight hash."""
+        path = Path(settings.models_dir) / (
+            f"{settings.classifier_model}-{weights_digest(self.model)}.onnx"
+        )
+        dummy_input = torch.zeros(1, 1, 224, 224, device=self.device)
+        return export_onnx(
+            self.model,
+            (dummy_input,),
+            path,
+            input_names=["input"],
+            output_names=["output"],
+            dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+        )
+    
+    def _capture_graph(self):
+        """
+        Capture the DenseNet conv stack as CUDA graphs, one per batch size.
+        
+        Only ``model.features`` is captured. XRV's forward also checks the
+        input range and applies op_norm with boolean-mask indexing, both of
+        which sync with the host and can't be captured; that small head
+        runs eagerly in _head. With mixed precision on, the graphs are
+        captured under autocast.
+        """
+        try:
+            # op_norm lives next to DenseNet in XRV; resolve it from there
+            self._op_norm = sys.modules[type(self.model).__module__].op_norm
+            pool = None
+            
+            # Largest batch first; the smaller graphs then reuse its memory pool
+            for batch_size in bucket_sizes(settings.batch_size):
+                static_in = torch.zeros(batch_size, 1, 224, 224, device=self.device)
+                
+                # The autocast weight cache must stay off: its FP16 weight copies
+                # are freed on exit, and the graph would keep reading them
+                with torch.no_grad(), autocast(self.device, self._use_amp, cache_enabled=False):
+                    # Warm up on a side stream before capture
+                    stream = torch.cuda.Stream()
+                    stream.wait_stream(torch.cuda.current_stream())
+                    with torch.cuda.stream(stream):
+                        for _ in range(3):
+                            self.model.features(static_in)
+                    torch.cuda.current_stream().wait_stream(stream)
+                    
+                    graph = torch.cuda.CUDAGraph()
+                    with torch.cuda.graph(graph, pool=pool):
+                        static_out = self.model.features(static_in)
+                
+                pool = graph.pool()
+                self._graphs[batch_size] = (graph, static_in, static_out)
+            
+            self._check_graphs()
+            print(f"Classifier CUDA graphs captured for batch sizes {sorted(self._graphs)}")
+        except Exception as e:
+            print(f"CUDA graph capture failed, using eager mode: {e}")
+            self._graphs = {}
+    
+    def _check_graphs(self):
+        """Raise if the graphed forward doesn't reproduce the eager model."""
+        rtol, atol = (1e-2, 1e-2) if self._use_amp else (1e-3, 1e-4)
+        with torch.no_grad(), autocast(self.device, self._use_amp, cache_enabled=False):
+            for batch_size in self._graphs:
+                sample = (torch.rand(batch_size, 1, 224, 224, device=self.device) - 0.5) * 2048
+                expected = self.model(sample).float()
+                actual = self._run_model(sample).float()
+                if not torch.allclose(actual, expected, rtol=rtol, atol=atol):
+                    raise RuntimeError(
+                        f"CUDA graph replay does not match eager output at batch size {batch_size}"
+                    )
+    
+    def _head(self, features: torch.Tensor) -> torch.Tensor:
+        """The rest of XRV's DenseNet.forward after the conv stack."""
+        out = F.relu(features)
+        out = F.adaptive_avg_pool2d(out, (1, 1)).flatten(1)
+        out = self.model.classifier(out)
+        if getattr(self.model, "apply_sigmoid", False):
+            out = torch.sigmoid(out)
+        if getattr(self.model, "op_threshs", None) is not None:
+            out = torch.sigmoid(out)
+            out = self._op_norm(out, self.model.op_threshs)
+        return out
+    
+    def _forward(self, input_tensor: torch.Tensor) -> torch.Tensor:
+        """Run the PyTorch classifier, with mixed precision when enabled."""
+        if self._use_amp:
+            outputs = self._forward_amp(input_tensor)
+            if outputs is not None:
+                return outputs
+        return self._run_model(input_tensor)
+    
+    def _forward_amp(self, input_tensor: torch.Tensor) -> Optional[torch.Tensor]:
+        """
+        Run the forward pass under autocast (FP16 on CUDA, BF16 on CPU).
+        
+        Returns None if mixed precision fails or produces non-finite
+        outputs, so the caller can rerun in FP32. Mixed precision, and the
+        graphs captured under it, are then dropped for this model so later
+        requests don't pay for both passes. Out-of-memory errors are
+        re-raised: they say nothing about precision.
+        """
+        try:
+            with autocast(self.device):
+                outputs = self._run_model(input_tensor).float()
+        except torch.cuda.OutOfMemoryError:
+            raise
+        except RuntimeError as e:
+            print(f"Mixed precision inference failed, using FP32 from now on: {e}")
+            self._disable_amp()
+            return None
+        
+        if not torch.isfinite(outputs).all():
+            print("Mixed precision produced non-finite outputs, using FP32 from now on")
+            self._disable_amp()
+            return None
+        return outputs
+    
+    def _disable_amp(self):
+        """Switch to FP32 for good; graphs captured under autocast go too."""
+        self._use_amp = False
+        self._graphs = {}
+    
+    def _run_model(self, input_tensor: torch.Tensor) -> torch.Tensor:
+        """Run the model, replaying the captured CUDA graphs when the shape matches."""
+        if not self._graphs or input_tensor.shape[1:] != (1, 224, 224):
+            return self.model(input_tensor)
+        
+        # Graphs exist only for bucket sizes, so run the batch in chunks of those
+        features = []
+        start = 0
+        for size in split_batch(input_tensor.shape[0], sorted(self._graphs, reverse=True)):
+            graph, static_in, static_out = self._graphs[size]
+            with self._graph_lock:
+                static_in.copy_(input_tensor[start:start + size])
+                graph.replay()
+                features.append(static_out.clone())
+            start += size
+        return self._head(torch.cat(features))
+    
     def _load_calibration(self):
         """Load calibration parameters."""
         calibration_path = Path(settings.models_dir) / settings.calibration_file
         
         if calibration_path.exists():
             try:
-                with open(calibration_path) as f:
-                    cal_data = json.load(f)
+                cal_data = _read_calibration(
+                    str(calibration_path), calibration_path.stat().st_mtime
+                )
                 
                 if "temperature" in cal_data:
                     self.calibrator = TemperatureScaling(cal_data["temperature"])
@@ -139,8 +333,8 @@ class CXRClassifier:
             # Use default temperature scaling
             self.calibrator = TemperatureScaling(1.2)  # Slight smoothing
     
-    def preprocess(self, image: Image.Image) -> torch.Tensor:
-        """Preprocess image for model input."""
+    def _prepare_array(self, image: Image.Image) -> np.ndarray:
+        """Convert an image to the [1, 224, 224] float32 array XRV expects."""
         # Convert to grayscale if needed
         if image.mode != "L":
             image = image.convert("L")
@@ -159,14 +353,77 @@ class CXRClassifier:
         img_array = img_array[np.newaxis, ...]
         
         # Apply transforms
-        img_array = self.transform(img_array)
+        return self.transform(img_array)
+    
+    def _uses_gpu(self) -> bool:
+        """Whether inference runs through PyTorch on a CUDA device."""
+        return self.session is None and str(self.device).startswith("cuda")
+    
+    def preprocess(self, image: Image.Image) -> torch.Tensor:
+        """Preprocess image for model input."""
+        img_array = self._prepare_array(image)
         
         # Convert to tensor and add batch dimension
-        tensor = torch.from_numpy(img_array).unsqueeze(0)
+        return torch.from_numpy(img_array).unsqueeze(0).to(self.device)
+    
+    def _preprocess_on_device(self, image: Image.Image) -> torch.Tensor:
+        """
+        GPU equivalent of preprocess: upload uint8 pixels, then center-crop,
+        resize and normalize on the device.
+        """
+        if image.mode != "L":
+            image = image.convert("L")
+        
+        img = torch.from_numpy(np.array(image, dtype=np.uint8)).to(self.device)
+        
+        # Center crop to a square, as XRayCenterCrop does
+        h, w = img.shape
+        size = min(h, w)
+        top = h // 2 - size // 2
+        left = w // 2 - size // 2
+        img = img[top:top + size, left:left + size]
+        
+        img = F.interpolate(
+            img[None, None].float(), size=(224, 224),
+            mode="bilinear", align_corners=False, antialias=True
+        )
         
-        return tensor.to(self.device)
+        # Same [-1024, 1024] scaling as _prepare_array
+        return (img / 255.0 - 0.5) * 2048
+    
+    @staticmethod
+    def _parity_sample() -> Image.Image:
+        """Deterministic smooth test image; non-square so the center crop is exercised."""
+        y, x = np.mgrid[0:1024, 0:1280].astype(np.float32)
+        pixels = 128 + 60 * np.sin(x / 90) * np.cos(y / 70) + 40 * np.sin((x + y) / 200)
+        return Image.fromarray(pixels.clip(0, 255).astype(np.uint8))
+    
+    def _check_preprocess_parity(self) -> bool:
+        """
+        Whether GPU preprocessing gives the same probabilities as the CPU path.
+        
+        F.interpolate's antialiasing filter is not skimage's, which XRV's
+        resizer uses, so the two can disagree enough to move a finding
+        across a threshold. Compare them once at load time and keep the
+        CPU path if they do.
+        """
+        try:
+            image = self._parity_sample()
+            with torch.inference_mode():
+                expected = self.model(self.preprocess(image))
+                actual = self.model(self._preprocess_on_device(image))
+            diff = (actual.float() - expected.float()).abs().max().item()
+        except Exception as e:
+            print(f"GPU preprocessing check failed, preprocessing on CPU: {e}")
+            return False
+        
+        if diff > 1e-2:
+            print(f"GPU preprocessing differs from XRV resize (max probability diff {diff:.4f}), "
+                  f"preprocessing on CPU")
+            return False
+        return True
     
-    @torch.no_grad()
+    @torch.inference_mode()
     def predict(self, image: Image.Image, calibrate: bool = True) -> Dict[str, Dict]:
         """
         Run prediction on an image.
@@ -178,64 +435,119 @@ class CXRClassifier:
         Returns:
             Dictionary with finding names and their probabilities
         """
+        result = self.predict_batch([image], calibrate=calibrate)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    
+    @torch.inference_mode()
+    def predict_batch(self, images: List[Image.Image], calibrate: bool = True) -> List[Dict[str, Dict]]:
+        """
+        Run prediction on a batch of images in a single forward pass.
+        
+        Args:
+            images: PIL Images
+            calibrate: Whether to apply probability calibration
+        
+        Returns:
+            One findings dictionary per image, in input order. An image that
+            fails preprocessing gets its exception in its slot instead, so
+            it doesn't fail the rest of the batch.
+        """
         if not self.loaded:
             raise RuntimeError("Model not loaded. Call load() first.")
         
-        # Preprocess
-        input_tensor = self.preprocess(image)
+        # Preprocess each image on its own so one bad upload can't fail the batch
+        prepare = self._preprocess_on_device if self._gpu_preprocess else self._prepare_array
+        results: List = [None] * len(images)
+        inputs = []
+        for i, image in enumerate(images):
+            try:
+                inputs.append((i, prepare(image)))
+            except Exception as e:
+                results[i] = e
+        if not inputs:
+            return results
         
-        # Run inference
-        outputs = self.model(input_tensor)
+        if self.session is not None:
+            # ONNX Runtime path: a single session.run on the numpy input
+            img_batch = np.stack([x for _, x in inputs])
+            probs = self.session.run(None, {"input": img_batch})[0]
+        else:
+            # Run inference
+            if self._gpu_preprocess:
+                input_tensor = torch.cat([x for _, x in inputs])
+            else:
+                img_batch = np.stack([x for _, x in inputs])
+                input_tensor = torch.from_numpy(img_batch).to(self.device)
+            outputs = self._forward(input_tensor)
+            
+            # Get probabilities (model outputs are already sigmoid-activated)
+            probs = outputs.cpu().numpy()
         
-        # Get probabilities (model outputs are already sigmoid-activated)
-        probs = outputs.cpu().numpy()[0]
+        # Temperature scaling works on logits, so convert the whole batch
+        # back in one pass instead of per finding
+        calibrated_probs = None
+        if calibrate and isinstance(self.calibrator, TemperatureScaling):
+            calibrated_probs = expit(self.calibrator.calibrate(logit(probs)))
         
-        # Map to our findings
+        for b, (i, _) in enumerate(inputs):
+            results[i] = self._map_outputs(
+                probs[b],
+                calibrated_probs[b] if calibrated_probs is not None else None,
+                calibrate
+            )
+        return results
+    
+    def _map_outputs(
+        self,
+        probs: np.ndarray,
+        calibrated_probs: Optional[np.ndarray],
+        calibrate: bool
+    ) -> Dict[str, Dict]:
+        """Map one image's model outputs to our findings."""
         results = {}
         
-        # TorchXRayVision pathologies
-        pathologies = self.model.pathologies
-        
-        for i, pathology in enumerate(pathologies):
-            if pathology in FINDING_MAPPING:
-                finding_name = FINDING_MAPPING[pathology]
-                raw_prob = float(probs[i])
-                
-                # Apply calibration
-                if calibrate and self.calibrator:
-                    if isinstance(self.calibrator, TemperatureScaling):
-                        # For temperature scaling, we need to convert back to logits
-                        logit = np.log(raw_prob / (1 - raw_prob + 1e-8))
-                        calibrated_logit = self.calibrator.calibrate(logit)
-                        calibrated_prob = 1 / (1 + np.exp(-calibrated_logit))
-                    else:
-                        calibrated_prob = self.calibrator.calibrate(finding_name, raw_prob)
-                else:
-                    calibrated_prob = raw_prob
-                
-                # Handle multiple mappings to same finding (take max)
-                if finding_name in results:
-                    if raw_prob > results[finding_name]["probability"]:
-                        results[finding_name] = {
-                            "probability": raw_prob,
-                            "calibrated_probability": float(calibrated_prob)
-                        }
+        for i, finding_name in self._output_slots:
+            raw_prob = float(probs[i])
+            
+            # Apply calibration
+            if calibrate and self.calibrator:
+                if calibrated_probs is not None:
+                    calibrated_prob = calibrated_probs[i]
                 else:
+                    calibrated_prob = self.calibrator.calibrate(finding_name, raw_prob)
+            else:
+                calibrated_prob = raw_prob
+            
+            # Handle multiple mappings to same finding (take max)
+            if finding_name in results:
+                if raw_prob > results[finding_name]["probability"]:
                     results[finding_name] = {
                         "probability": raw_prob,
                         "calibrated_probability": float(calibrated_prob)
                     }
+            else:
+                results[finding_name] = {
+                    "probability": raw_prob,
+                    "calibrated_probability": float(calibrated_prob)
+                }
         
         return results
     
-    def get_info(self) -> Dict:
-        """Get model information."""
+    def get_info(self) -> Mapping:
+        """Get model information (read-only, rebuilt on load)."""
+        return self._info
+    
+    def _build_info(self) -> Dict:
+        """Build the model information returned by get_info."""
         return {
             "name": self.config.get("name", "Unknown"),
             "version": self.config.get("version", "Unknown"),
             "status": "loaded" if self.loaded else "not_loaded",
             "device": self.device,
-            "findings_supported": list(set(FINDING_MAPPING.values())),
+            "runtime": "onnxruntime" if self.session is not None else "pytorch",
+            "findings_supported": tuple(set(FINDING_MAPPING.values())),
             "source": self.config.get("source", "unknown")
         }
 
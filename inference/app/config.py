@@ -21,8 +21,13 @@ class Settings(BaseSettings):
     calibration_file: str = "calibration.json"
     
     # Performance
-    batch_size: int = 1
+    batch_size: int = 16  # Max images coalesced into one forward pass
+    batch_wait_ms: float = 10.0  # Max time a request waits for a batch to fill
     num_workers: int = 2
+    compile_detector: bool = True
+    use_amp: bool = True  # Autocast PyTorch model forwards (FP16 on CUDA, BF16 on CPUs with native BF16)
+    quantize_cpu: bool = True  # INT8 detector on CPU (needs calibration images)
+    detector_gate_threshold: float = 0.15  # Skip detector below this max finding probability (0 disables)
     
     class Config:
         env_prefix = "INFERENCE_"
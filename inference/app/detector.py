@@ -4,68 +4,116 @@ Implements a detector based on pretrained weights for nodule/mass detection.
 """
 import os
 import json
+import threading
 import numpy as np
-from typing import Dict, List, Optional, Tuple
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
 from pathlib import Path
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import torchvision
+from torchvision.ops import batched_nms
 from torchvision.models.detection import fasterrcnn_resnet50_fpn, FasterRCNN_ResNet50_FPN_Weights
 from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
 import torchvision.transforms as transforms
 from PIL import Image
 
 from app.config import settings, DETECTOR_CONFIG, DETECTOR_CLASS_MAPPING
+from app.amp import amp_supported, autocast
+from app.batcher import bucket_sizes, split_batch
+from app.onnx_utils import (
+    ONNXRUNTIME_AVAILABLE, weights_digest, export_onnx, create_session, quantize_onnx
+)
 
 
-def non_max_suppression(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> List[int]:
+class _GraphedBackbone(nn.Module):
     """
-    Apply non-maximum suppression.
+    Backbone + FPN wrapper that replays captured CUDA graphs.
     
-    Args:
-        boxes: Array of shape (N, 4) with [x1, y1, x2, y2] format
-        scores: Array of shape (N,) with confidence scores
-        iou_threshold: IoU threshold for suppression
-    
-    Returns:
-        List of indices to keep
+    Faster R-CNN's proposal and RoI stages produce variable-length outputs,
+    so only the fixed-shape backbone is captured; the heads stay eager.
+    One graph is captured per batch size, sharing a single memory pool.
+    Inputs that don't match a captured shape or the autocast state run eagerly.
     """
-    if len(boxes) == 0:
-        return []
     
-    x1 = boxes[:, 0]
-    y1 = boxes[:, 1]
-    x2 = boxes[:, 2]
-    y2 = boxes[:, 3]
+    def __init__(
+        self,
+        backbone: nn.Module,
+        image_shape: Tuple[int, ...],
+        batch_sizes: List[int],
+        use_amp: bool
+    ):
+        super().__init__()
+        self.backbone = backbone
+        self.out_channels = backbone.out_channels
+        self.use_amp = use_amp
+        self._lock = threading.Lock()
+        self._graphs: Dict[int, Tuple[torch.cuda.CUDAGraph, torch.Tensor, Dict]] = {}
+        
+        device = next(backbone.parameters()).device
+        pool = None
+        
+        # Largest batch first; the smaller graphs then reuse its memory pool.
+        # Replays are serialized by the lock, so the graphs never overlap.
+        for batch_size in sorted(batch_sizes, reverse=True):
+            static_in = torch.zeros((batch_size, *image_shape), device=device)
+            
+            # The autocast weight cache must stay off: cached FP16 weight copies
+            # are freed when the autocast block exits, and the graph would keep
+            # reading that memory on every replay
+            with torch.no_grad(), self._autocast():
+                # Warm up on a side stream before capture
+                stream = torch.cuda.Stream()
+                stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(stream):
+                    for _ in range(3):
+                        backbone(static_in)
+                torch.cuda.current_stream().wait_stream(stream)
+                
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph, pool=pool):
+                    static_out = backbone(static_in)
+            
+            pool = graph.pool()
+            self._graphs[batch_size] = (graph, static_in, static_out)
+            self._check_replay(batch_size)
     
-    areas = (x2 - x1) * (y2 - y1)
-    order = scores.argsort()[::-1]
+    def _autocast(self):
+        """Autocast context matching request-time precision, without the weight cache."""
+        return autocast("cuda", enabled=self.use_amp, cache_enabled=False)
     
-    keep = []
-    while order.size > 0:
-        i = order[0]
-        keep.append(i)
-        
-        if order.size == 1:
-            break
-        
-        xx1 = np.maximum(x1[i], x1[order[1:]])
-        yy1 = np.maximum(y1[i], y1[order[1:]])
-        xx2 = np.minimum(x2[i], x2[order[1:]])
-        yy2 = np.minimum(y2[i], y2[order[1:]])
-        
-        w = np.maximum(0, xx2 - xx1)
-        h = np.maximum(0, yy2 - yy1)
-        
-        intersection = w * h
-        union = areas[i] + areas[order[1:]] - intersection
-        iou = intersection / (union + 1e-8)
-        
-        inds = np.where(iou <= iou_threshold)[0]
-        order = order[inds + 1]
+    def _check_replay(self, batch_size: int):
+        """Raise if replaying a graph doesn't reproduce the eager backbone."""
+        graph, static_in, static_out = self._graphs[batch_size]
+        sample = torch.rand_like(static_in)
+        with torch.no_grad(), self._autocast():
+            expected = self.backbone(sample)
+            static_in.copy_(sample)
+            graph.replay()
+        
+        for key, value in expected.items():
+            if not torch.allclose(static_out[key].float(), value.float(), rtol=1e-2, atol=1e-2):
+                raise RuntimeError(
+                    f"CUDA graph replay does not match eager output for feature {key} "
+                    f"at batch size {batch_size}"
+                )
     
-    return keep
+    def forward(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        entry = self._graphs.get(x.shape[0])
+        if (
+            entry is None
+            or x.shape != entry[1].shape
+            or torch.is_autocast_enabled() != self.use_amp
+        ):
+            return self.backbone(x)
+        
+        graph, static_in, static_out = entry
+        with self._lock:
+            static_in.copy_(x)
+            graph.replay()
+            return {k: v.clone() for k, v in static_out.items()}
 
 
 class CXRDetector:
@@ -77,10 +125,16 @@ class CXRDetector:
     def __init__(self, device: str = "cuda"):
         self.device = device if torch.cuda.is_available() else "cpu"
         self.model = None
+        self.session = None
+        self.scripted = False
+        self._batch_sizes: Optional[List[int]] = None  # Set when the backbone only runs fixed shapes
+        # Mixed precision; switched off for good if it ever fails on this model
+        self._use_amp = settings.use_amp and amp_supported(self.device)
         self.transform = None
         self.config = DETECTOR_CONFIG.get(settings.detector_model, {})
         self.loaded = False
         self.num_classes = len(DETECTOR_CLASS_MAPPING) + 1  # +1 for background
+        self._info = MappingProxyType(self._build_info())
         
     def load(self) -> bool:
         """Load the detector model."""
@@ -89,8 +143,14 @@ class CXRDetector:
             
             # Check for custom weights
             weights_path = Path(settings.models_dir) / "detector_weights.pth"
+            scripted_path = Path(settings.models_dir) / "detector_scripted.pt"
             
-            if weights_path.exists():
+            if scripted_path.exists():
+                # TorchScript export from scripts/script_detector.py
+                self.model = self._load_scripted(scripted_path)
+                self.scripted = True
+                print("Loaded TorchScript detector")
+            elif weights_path.exists():
                 # Load custom trained weights
                 self.model = self._create_model()
                 state_dict = torch.load(weights_path, map_location=self.device)
@@ -111,7 +171,31 @@ class CXRDetector:
                 transforms.ToTensor(),
             ])
             
+            # Prefer TorchScript if exported, then ONNX Runtime, then (compiled) PyTorch
+            if self.scripted:
+                self._warmup_scripted()
+            elif settings.use_onnx and ONNXRUNTIME_AVAILABLE:
+                try:
+                    onnx_path = self.export_onnx()
+                    if self.device == "cpu" and settings.quantize_cpu:
+                        onnx_path = self._quantize_model(onnx_path)
+                    self.session = create_session(onnx_path, self.device)
+                except Exception as e:
+                    print(f"ONNX Runtime unavailable for detector, using PyTorch: {e}")
+                    self.session = None
+            
+            if self.session is None and not self.scripted:
+                # NHWC weights let cuDNN/oneDNN pick their fast conv kernels
+                self.model = self.model.to(memory_format=torch.channels_last)
+                
+                # torch.compile's reduce-overhead mode already uses CUDA graphs;
+                # capture one by hand only if compilation is off or failed
+                compiled = settings.compile_detector and self._compile_model()
+                if not compiled and str(self.device).startswith("cuda"):
+                    self._capture_backbone_graph()
+            
             self.loaded = True
+            self._info = MappingProxyType(self._build_info())
             print("Detector loaded successfully")
             return True
             
@@ -121,18 +205,240 @@ class CXRDetector:
             traceback.print_exc()
             return False
     
+    def _load_scripted(self, path: Path) -> torch.jit.ScriptModule:
+        """Load a TorchScript detector and apply inference-time graph optimizations."""
+        model = torch.jit.load(str(path), map_location=self.device)
+        model.eval()
+        try:
+            model = torch.jit.optimize_for_inference(torch.jit.freeze(model))
+        except Exception as e:
+            print(f"TorchScript optimize_for_inference skipped: {e}")
+        return model
+    
+    def _warmup_scripted(self):
+        """Run two dummy forwards so the JIT profiling passes happen at load time."""
+        dummy_input = torch.zeros(3, 512, 512, device=self.device)
+        with torch.inference_mode():
+            for _ in range(2):
+                self.model([dummy_input])
+    
+    def export_onnx(self) -> Path:
+        """Export the detector to ONNX, cached on disk by weight hash."""
+        path = Path(settings.models_dir) / (
+            f"{settings.detector_model}-{weights_digest(self.model)}.onnx"
+        )
+        dummy_input = torch.zeros(3, 512, 512, device=self.device)
+        return export_onnx(
+            self.model,
+            ([dummy_input],),
+            path,
+            input_names=["input"],
+            output_names=["boxes", "labels", "scores"],
+            dynamic_axes={
+                "boxes": {0: "detections"},
+                "labels": {0: "detections"},
+                "scores": {0: "detections"},
+            },
+        )
+    
+    def _quantize_model(self, fp32_path: Path) -> Path:
+        """
+        Statically quantize the exported detector to INT8 (QDQ) for CPU.
+        
+        Calibrates on the sample images in ``models_dir/calibration``.
+        Returns the FP32 path unchanged if there are no calibration images
+        or quantization fails.
+        """
+        int8_path = fp32_path.with_name(fp32_path.stem + "-int8.onnx")
+        if int8_path.exists():
+            return int8_path
+        
+        calibration_dir = Path(settings.models_dir) / "calibration"
+        image_paths = sorted(
+            p for p in calibration_dir.glob("*")
+            if p.suffix.lower() in (".png", ".jpg", ".jpeg")
+        )[:16]
+        
+        if not image_paths:
+            print("No detector calibration images found, skipping INT8 quantization")
+            return fp32_path
+        
+        try:
+            calibration_inputs = []
+            for image_path in image_paths:
+                with Image.open(image_path) as image:
+                    tensor, _ = self.preprocess(image)
+                calibration_inputs.append({"input": tensor.cpu().numpy()})
+            
+            quantize_onnx(fp32_path, int8_path, calibration_inputs)
+            print(f"Detector quantized to INT8 with {len(image_paths)} calibration images")
+            return int8_path
+        except Exception as e:
+            print(f"INT8 quantization failed, using FP32 detector: {e}")
+            return fp32_path
+    
+    def _run_model(self, input_tensors: List[torch.Tensor]) -> List[Dict[str, torch.Tensor]]:
+        """Run the detector on preprocessed images and return one raw output per image."""
+        if self.session is not None:
+            # torchvision exports Faster R-CNN for a fixed-length image list,
+            # so the ONNX graph takes one image and a batch costs one
+            # session.run per image; batching only saves the queueing here
+            outputs = []
+            for input_tensor in input_tensors:
+                boxes, labels, scores = self.session.run(
+                    None, {"input": input_tensor.cpu().numpy()}
+                )
+                outputs.append({
+                    "boxes": torch.from_numpy(boxes),
+                    "labels": torch.from_numpy(labels),
+                    "scores": torch.from_numpy(scores),
+                })
+            return outputs
+        if self.scripted:
+            # Scripted GeneralizedRCNN returns (losses, detections)
+            _, outputs = self.model(input_tensors)
+            return outputs
+        if self._batch_sizes is None:
+            return self._forward_torch(input_tensors)
+        
+        # A compiled or graphed backbone only covers the batch sizes it was
+        # built for, so run the batch as chunks of those sizes
+        outputs = []
+        start = 0
+        for size in split_batch(len(input_tensors), self._batch_sizes):
+            outputs.extend(self._forward_torch(input_tensors[start:start + size]))
+            start += size
+        return outputs
+    
+    def _forward_torch(self, input_tensors: List[torch.Tensor]) -> List[Dict[str, torch.Tensor]]:
+        """Run the PyTorch detector, with mixed precision when enabled."""
+        if self._use_amp:
+            outputs = self._forward_amp(input_tensors)
+            if outputs is not None:
+                return outputs
+        return self.model(input_tensors)
+    
+    def _forward_amp(self, input_tensors: List[torch.Tensor]) -> Optional[List[Dict[str, torch.Tensor]]]:
+        """
+        Run the forward pass under autocast (FP16 on CUDA, BF16 on CPU).
+        
+        Returns None if mixed precision fails or produces non-finite
+        outputs, so the caller can rerun in FP32. Mixed precision is then
+        disabled for this model so later requests don't pay for both passes.
+        Out-of-memory errors are re-raised: they say nothing about precision.
+        """
+        try:
+            with autocast(self.device):
+                outputs = self.model(input_tensors)
+        except torch.cuda.OutOfMemoryError:
+            # Not a precision problem, and FP32 would need even more memory
+            raise
+        except RuntimeError as e:
+            print(f"Mixed precision inference failed, using FP32 from now on: {e}")
+            self._use_amp = False
+            return None
+        
+        outputs = [
+            {k: v.float() if v.is_floating_point() else v for k, v in output.items()}
+            for output in outputs
+        ]
+        for output in outputs:
+            if not (torch.isfinite(output["boxes"]).all() and torch.isfinite(output["scores"]).all()):
+                print("Mixed precision produced non-finite outputs, using FP32 from now on")
+                self._use_amp = False
+                return None
+        return outputs
+    
+    def _compile_model(self) -> bool:
+        """
+        Compile the backbone + FPN with torch.compile and warm it up.
+        
+        The RPN/RoI heads produce variable-length outputs and would force
+        recompiles, so only the fixed-shape backbone is compiled, once per
+        batch size in bucket_sizes(settings.batch_size).
+        
+        Returns:
+            True if the compiled backbone is in use
+        """
+        if not hasattr(torch, "compile"):
+            return False
+        
+        try:
+            import torch._dynamo
+            
+            self._batch_sizes = bucket_sizes(settings.batch_size)
+            
+            # One compiled graph per batch size (and per autocast state, in
+            # case mixed precision gets disabled); keep dynamo from falling
+            # back to eager once it has seen that many
+            torch._dynamo.config.cache_size_limit = max(
+                torch._dynamo.config.cache_size_limit, 2 * len(self._batch_sizes)
+            )
+            self.model.backbone = torch.compile(
+                self.model.backbone, mode="reduce-overhead", dynamic=False
+            )
+            
+            # Pay the compile cost for every batch size at startup rather
+            # than in the middle of a live request
+            dummy_input = torch.zeros(3, 512, 512, device=self.device)
+            with torch.inference_mode():
+                for size in self._batch_sizes:
+                    self._run_model([dummy_input] * size)
+            print(f"Detector backbone compiled for batch sizes {self._batch_sizes}")
+            return True
+        except Exception as e:
+            print(f"torch.compile failed, using eager backbone: {e}")
+            self.model.backbone = getattr(self.model.backbone, "_orig_mod", self.model.backbone)
+            self._batch_sizes = None
+            return False
+    
+    def _capture_backbone_graph(self):
+        """Capture the backbone + FPN forward for 512x512 inputs as CUDA graphs, one per batch size."""
+        try:
+            # The model's own transform resizes/pads the 512x512 input;
+            # run it once to find the shape the backbone actually sees
+            dummy_input = torch.zeros(3, 512, 512, device=self.device)
+            with torch.no_grad():
+                image_list, _ = self.model.transform([dummy_input])
+            image_shape = tuple(image_list.tensors.shape[1:])
+            
+            batch_sizes = bucket_sizes(settings.batch_size)
+            self.model.backbone = _GraphedBackbone(
+                self.model.backbone, image_shape, batch_sizes, self._use_amp
+            )
+            self._batch_sizes = batch_sizes
+            print(f"Detector backbone CUDA graphs captured for {image_shape} at batch sizes {batch_sizes}")
+        except Exception as e:
+            print(f"CUDA graph capture failed, using eager backbone: {e}")
+    
     def _create_model(self, pretrained: bool = False) -> nn.Module:
         """Create the Faster R-CNN model."""
-        if pretrained:
+        # The assembled pretrained model is cached locally after the first
+        # load so restarts skip the torchvision weight download
+        cache_path = Path(settings.models_dir) / f"frcnn_init_{self.num_classes}.pth"
+        use_cache = pretrained and cache_path.exists()
+        
+        if pretrained and not use_cache:
             # Load pretrained model
             model = fasterrcnn_resnet50_fpn(weights=FasterRCNN_ResNet50_FPN_Weights.DEFAULT)
         else:
-            model = fasterrcnn_resnet50_fpn(weights=None)
+            model = fasterrcnn_resnet50_fpn(weights=None, weights_backbone=None)
         
         # Replace the classifier head for our number of classes
         in_features = model.roi_heads.box_predictor.cls_score.in_features
         model.roi_heads.box_predictor = FastRCNNPredictor(in_features, self.num_classes)
         
+        if use_cache:
+            model.load_state_dict(torch.load(cache_path, map_location="cpu"))
+            print(f"Loaded cached pretrained detector from {cache_path}")
+        elif pretrained:
+            try:
+                tmp_path = cache_path.with_suffix(".pth.tmp")
+                torch.save(model.state_dict(), tmp_path)
+                tmp_path.replace(cache_path)
+            except OSError as e:
+                print(f"Could not cache pretrained detector: {e}")
+        
         return model
     
     def preprocess(self, image: Image.Image) -> Tuple[torch.Tensor, Tuple[int, int]]:
@@ -148,12 +454,22 @@ class CXRDetector:
         if image.mode != "RGB":
             image = image.convert("RGB")
         
+        if str(self.device).startswith("cuda"):
+            # Upload uint8 pixels (4x less than float32) and resize on the GPU
+            rgb = torch.from_numpy(np.array(image, dtype=np.uint8))
+            tensor = rgb.pin_memory().to(self.device, non_blocking=True)
+            tensor = tensor.permute(2, 0, 1).unsqueeze(0).float()
+            tensor = F.interpolate(
+                tensor, size=(512, 512), mode="bilinear", align_corners=False, antialias=True
+            )
+            return tensor[0] / 255.0, original_size
+        
         # Apply transforms
         tensor = self.transform(image)
         
         return tensor.to(self.device), original_size
     
-    @torch.no_grad()
+    @torch.inference_mode()
     def predict(
         self,
         image: Image.Image,
@@ -173,20 +489,78 @@ class CXRDetector:
         Returns:
             List of detection dictionaries with boxes and classes
         """
+        result = self.predict_batch(
+            [image],
+            conf_threshold=conf_threshold,
+            iou_threshold=iou_threshold,
+            max_boxes=max_boxes
+        )[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    
+    @torch.inference_mode()
+    def predict_batch(
+        self,
+        images: List[Image.Image],
+        conf_threshold: float = 0.25,
+        iou_threshold: float = 0.45,
+        max_boxes: int = 10
+    ) -> List[List[Dict]]:
+        """
+        Run detection on a batch of images.
+        
+        The PyTorch paths run the batch in a single forward pass (in
+        bucket-sized chunks when the backbone is compiled or graphed);
+        ONNX Runtime runs one image at a time.
+        
+        Returns:
+            One list of detection dictionaries per image, in input order.
+            An image that fails preprocessing gets its exception in its
+            slot instead, so it doesn't fail the rest of the batch.
+        """
         if not self.loaded:
             raise RuntimeError("Model not loaded. Call load() first.")
         
-        # Preprocess
-        input_tensor, original_size = self.preprocess(image)
+        # Preprocess each image on its own so one bad upload can't fail the batch
+        results: List = [None] * len(images)
+        indices = []
+        input_tensors = []
+        original_sizes = []
+        for i, image in enumerate(images):
+            try:
+                input_tensor, original_size = self.preprocess(image)
+            except Exception as e:
+                results[i] = e
+                continue
+            indices.append(i)
+            input_tensors.append(input_tensor)
+            original_sizes.append(original_size)
+        if not input_tensors:
+            return results
         
         # Run inference
-        outputs = self.model([input_tensor])
+        outputs = self._run_model(input_tensors)
         
-        # Process outputs
-        output = outputs[0]
-        boxes = output["boxes"].cpu().numpy()
-        scores = output["scores"].cpu().numpy()
-        labels = output["labels"].cpu().numpy()
+        for i, output, original_size in zip(indices, outputs, original_sizes):
+            results[i] = self._postprocess(
+                output, original_size, conf_threshold, iou_threshold, max_boxes
+            )
+        return results
+    
+    def _postprocess(
+        self,
+        output: Dict[str, torch.Tensor],
+        original_size: Tuple[int, int],
+        conf_threshold: float,
+        iou_threshold: float,
+        max_boxes: int
+    ) -> List[Dict]:
+        """Filter, suppress, and format one image's raw detections."""
+        # Process outputs (kept on-device until after NMS)
+        boxes = output["boxes"]
+        scores = output["scores"]
+        labels = output["labels"]
         
         # Filter by confidence
         mask = scores >= conf_threshold
@@ -194,73 +568,57 @@ class CXRDetector:
         scores = scores[mask]
         labels = labels[mask]
         
-        if len(boxes) == 0:
+        if boxes.numel() == 0:
             return []
         
-        # Apply NMS
-        keep_indices = non_max_suppression(boxes, scores, iou_threshold)
-        boxes = boxes[keep_indices]
-        scores = scores[keep_indices]
-        labels = labels[keep_indices]
-        
-        # Limit number of boxes
-        if len(boxes) > max_boxes:
-            top_indices = np.argsort(scores)[::-1][:max_boxes]
-            boxes = boxes[top_indices]
-            scores = scores[top_indices]
-            labels = labels[top_indices]
+        # Apply per-class NMS; kept indices are sorted by descending score
+        keep = batched_nms(boxes, scores, labels, iou_threshold)[:max_boxes]
+        boxes = boxes[keep].cpu().numpy()
+        scores = scores[keep].cpu().numpy()
+        labels = labels[keep].cpu().numpy()
         
         # Convert to output format
-        results = []
         input_size = 512  # Our resize target
         orig_w, orig_h = original_size
         
-        for box, score, label in zip(boxes, scores, labels):
-            # Convert to normalized coordinates
-            x1, y1, x2, y2 = box
-            
-            # Normalize to [0, 1]
-            x1_norm = x1 / input_size
-            y1_norm = y1 / input_size
-            x2_norm = x2 / input_size
-            y2_norm = y2 / input_size
-            
-            # Convert to original pixel coordinates
-            x1_px = int(x1_norm * orig_w)
-            y1_px = int(y1_norm * orig_h)
-            x2_px = int(x2_norm * orig_w)
-            y2_px = int(y2_norm * orig_h)
-            
-            # Get class name
-            class_id = int(label) - 1  # Subtract 1 because 0 is background
-            if class_id in DETECTOR_CLASS_MAPPING:
-                class_name = DETECTOR_CLASS_MAPPING[class_id]
-            else:
-                class_name = "unknown"
-            
-            results.append({
-                "name": class_name,
+        # Normalize to [0, 1], then scale to original pixel coordinates
+        boxes_norm = boxes / input_size
+        boxes_px = (boxes_norm * np.array([orig_w, orig_h, orig_w, orig_h])).astype(np.int32)
+        class_ids = labels.astype(np.int32) - 1  # Subtract 1 because 0 is background
+        
+        results = [
+            {
+                "name": DETECTOR_CLASS_MAPPING.get(int(class_id), "unknown"),
                 "confidence": float(score),
-                "x_min": float(x1_norm),
-                "y_min": float(y1_norm),
-                "x_max": float(x2_norm),
-                "y_max": float(y2_norm),
-                "x_min_px": x1_px,
-                "y_min_px": y1_px,
-                "x_max_px": x2_px,
-                "y_max_px": y2_px
-            })
+                "x_min": float(bn[0]),
+                "y_min": float(bn[1]),
+                "x_max": float(bn[2]),
+                "y_max": float(bn[3]),
+                "x_min_px": int(bp[0]),
+                "y_min_px": int(bp[1]),
+                "x_max_px": int(bp[2]),
+                "y_max_px": int(bp[3])
+            }
+            for bn, bp, score, class_id in zip(boxes_norm, boxes_px, scores, class_ids)
+        ]
         
         return results
     
-    def get_info(self) -> Dict:
-        """Get model information."""
+    def get_info(self) -> Mapping:
+        """Get model information (read-only, rebuilt on load)."""
+        return self._info
+    
+    def _build_info(self) -> Dict:
+        """Build the model information returned by get_info."""
         return {
             "name": self.config.get("name", "Faster R-CNN Detector"),
             "version": self.config.get("version", "1.0.0"),
             "status": "loaded" if self.loaded else "not_loaded",
             "device": self.device,
-            "findings_supported": list(DETECTOR_CLASS_MAPPING.values()),
+            "runtime": "onnxruntime" if self.session is not None else (
+                "torchscript" if self.scripted else "pytorch"
+            ),
+            "findings_supported": tuple(DETECTOR_CLASS_MAPPING.values()),
             "source": self.config.get("source", "torchvision")
         }
 
@@ -273,10 +631,12 @@ class SimpleNoduleDetector:
     
     def __init__(self):
         self.loaded = False
+        self._info = MappingProxyType(self._build_info())
     
     def load(self) -> bool:
         """Load the detector (no-op for this simple detector)."""
         self.loaded = True
+        self._info = MappingProxyType(self._build_info())
         return True
     
     def predict(
@@ -320,59 +680,85 @@ class SimpleNoduleDetector:
             maxRadius=50
         )
         
-        results = []
+        if circles is None:
+            return []
         
-        if circles is not None:
-            circles = np.uint16(np.around(circles))
-            
-            for circle in circles[0, :max_boxes]:
-                cx, cy, r = circle
-                
-                # Convert to box coordinates
-                x1 = max(0, cx - r)
-                y1 = max(0, cy - r)
-                x2 = min(512, cx + r)
-                y2 = min(512, cy + r)
-                
-                # Normalize
-                x1_norm = x1 / 512
-                y1_norm = y1 / 512
-                x2_norm = x2 / 512
-                y2_norm = y2 / 512
-                
-                # Calculate confidence based on circularity and intensity
-                roi = img_resized[int(y1):int(y2), int(x1):int(x2)]
-                if roi.size > 0:
-                    intensity_score = 1 - (np.mean(roi) / 255)  # Darker = higher score
-                    size_score = min(1.0, r / 30)  # Reasonable size
-                    confidence = (intensity_score + size_score) / 2 * 0.5 + 0.25
-                else:
-                    confidence = 0.25
-                
-                if confidence >= conf_threshold:
-                    results.append({
-                        "name": "nodule",
-                        "confidence": float(confidence),
-                        "x_min": float(x1_norm),
-                        "y_min": float(y1_norm),
-                        "x_max": float(x2_norm),
-                        "y_max": float(y2_norm),
-                        "x_min_px": int(x1_norm * orig_w),
-                        "y_min_px": int(y1_norm * orig_h),
-                        "x_max_px": int(x2_norm * orig_w),
-                        "y_max_px": int(y2_norm * orig_h)
-                    })
+        # Signed ints so cx - r can't wrap around for circles near the edge
+        circles = np.around(circles[0, :max_boxes]).astype(np.int32)
+        cx, cy, r = circles[:, 0], circles[:, 1], circles[:, 2]
+        
+        # Convert to box coordinates
+        x1 = np.maximum(0, cx - r)
+        y1 = np.maximum(0, cy - r)
+        x2 = np.minimum(512, cx + r)
+        y2 = np.minimum(512, cy + r)
+        
+        # Mean ROI intensity from four integral-image reads per box
+        integral = cv2.integral(img_resized)
+        roi_sum = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        area = (y2 - y1) * (x2 - x1)
+        
+        # Calculate confidence based on circularity and intensity
+        intensity_score = 1 - roi_sum / np.maximum(area, 1) / 255  # Darker = higher score
+        size_score = np.minimum(1.0, r / 30)  # Reasonable size
+        confidence = np.where(
+            area > 0, (intensity_score + size_score) / 2 * 0.5 + 0.25, 0.25
+        )
+        
+        keep = confidence >= conf_threshold
+        boxes_norm = np.stack([x1, y1, x2, y2], axis=1)[keep] / 512
+        boxes_px = (boxes_norm * np.array([orig_w, orig_h, orig_w, orig_h])).astype(np.int64)
+        
+        results = [
+            {
+                "name": "nodule",
+                "confidence": float(conf),
+                "x_min": float(bn[0]),
+                "y_min": float(bn[1]),
+                "x_max": float(bn[2]),
+                "y_max": float(bn[3]),
+                "x_min_px": int(bp[0]),
+                "y_min_px": int(bp[1]),
+                "x_max_px": int(bp[2]),
+                "y_max_px": int(bp[3])
+            }
+            for bn, bp, conf in zip(boxes_norm, boxes_px, confidence[keep])
+        ]
+        
+        return results
+    
+    def predict_batch(
+        self,
+        images: List[Image.Image],
+        conf_threshold: float = 0.25,
+        iou_threshold: float = 0.45,
+        max_boxes: int = 10
+    ) -> List[List[Dict]]:
+        """
+        Detect nodules in each image (no batched kernel for this detector).
         
+        A failing image gets its exception in its slot, as with CXRDetector.
+        """
+        results: List = []
+        for image in images:
+            try:
+                results.append(self.predict(image, conf_threshold, iou_threshold, max_boxes))
+            except Exception as e:
+                results.append(e)
         return results
     
-    def get_info(self) -> Dict:
-        """Get model information."""
+    def get_info(self) -> Mapping:
+        """Get model information (read-only, rebuilt on load)."""
+        return self._info
+    
+    def _build_info(self) -> Dict:
+        """Build the model information returned by get_info."""
         return {
             "name": "Simple Nodule Detector",
             "version": "1.0.0",
             "status": "loaded" if self.loaded else "not_loaded",
             "device": "cpu",
-            "findings_supported": ["nodule"],
+            "findings_supported": ("nodule",),
             "source": "image_processing"
         }
 
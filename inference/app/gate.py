@@ -0,0 +1,25 @@
+"""
+Classifier gate that decides whether the detector runs on an image.
+"""
+from typing import Dict, List
+
+
+def should_run_detector(findings: List[Dict], threshold: float) -> bool:
+    """
+    Whether the detector should run given the classifier's findings.
+    
+    The detector is skipped only when the classifier produced findings
+    and every calibrated probability is below ``threshold``. With no
+    findings (classifier not loaded or failed) it always runs, and a
+    threshold of 0 disables the gate.
+    
+    Args:
+        findings: Classifier findings with a ``calibrated_probability``
+        threshold: Minimum max calibrated probability to run the detector
+    
+    Returns:
+        True if the detector should run
+    """
+    if not findings:
+        return True
+    return max(f["calibrated_probability"] for f in findings) >= threshold
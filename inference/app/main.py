@@ -4,11 +4,13 @@ Inference Service - FastAPI application for CXR model inference.
 import os
 import io
 import time
+import asyncio
 from typing import Optional, Dict, Any, List
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from PIL import Image
 import numpy as np
@@ -17,6 +19,8 @@ from app import __version__
 from app.config import settings
 from app.classifier import CXRClassifier, get_classifier
 from app.detector import CXRDetector, get_detector, SimpleNoduleDetector
+from app.batcher import InferenceBatcher
+from app.gate import should_run_detector
 
 
 # Global model instances
@@ -24,6 +28,14 @@ classifier: Optional[CXRClassifier] = None
 detector = None
 models_loaded = False
 
+# Static part of the per-request model_info, rebuilt whenever models load
+# (plain dicts, since orjson can't serialize the read-only info mappings)
+model_info_base: Dict[str, Any] = {"classifier": None, "detector": None}
+
+# Request coalescing for the models
+classifier_batcher: Optional[InferenceBatcher] = None
+detector_batcher: Optional[InferenceBatcher] = None
+
 
 class HealthResponse(BaseModel):
     status: str
@@ -66,7 +78,7 @@ class AnalysisResponse(BaseModel):
 
 def load_models():
     """Load all models."""
-    global classifier, detector, models_loaded
+    global classifier, detector, models_loaded, model_info_base
     
     print("Loading models...")
     
@@ -94,25 +106,61 @@ def load_models():
         detector.load()
     
     models_loaded = classifier is not None or detector is not None
+    model_info_base = {
+        "classifier": dict(classifier.get_info()) if classifier else None,
+        "detector": dict(detector.get_info()) if detector else None
+    }
     print(f"Models loaded: classifier={classifier is not None}, detector={detector is not None}")
 
 
+def _decode(image_bytes: bytes) -> Image.Image:
+    """Open and fully decode an uploaded image."""
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    return image
+
+
+def _classify_batch(images: List[Image.Image], **kwargs) -> List[Dict]:
+    """Batch entry point that always uses the currently loaded classifier."""
+    return classifier.predict_batch(images, **kwargs)
+
+
+def _detect_batch(images: List[Image.Image], **kwargs) -> List[List[Dict]]:
+    """Batch entry point that always uses the currently loaded detector."""
+    return detector.predict_batch(images, **kwargs)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler."""
+    global classifier_batcher, detector_batcher
+    
     # Startup
     print("Starting Inference Service...")
-    load_models()
+    classifier_batcher = InferenceBatcher(_classify_batch, settings.batch_size, settings.batch_wait_ms)
+    detector_batcher = InferenceBatcher(_detect_batch, settings.batch_size, settings.batch_wait_ms)
+    
+    # The compiled detector's CUDA graph state is per thread, so load and
+    # warm it up on the thread that will run its batches
+    await detector_batcher.run_in_thread(load_models)
+    
+    classifier_batcher.start()
+    detector_batcher.start()
+    
     yield
+    
     # Shutdown
     print("Shutting down Inference Service...")
+    await classifier_batcher.stop()
+    await detector_batcher.stop()
 
 
 app = FastAPI(
     title="CXR Inference Service",
     description="AI inference service for Chest X-ray analysis",
     version=__version__,
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -149,7 +197,7 @@ async def get_models_info():
     )
 
 
-@app.post("/analyze", response_model=AnalysisResponse)
+@app.post("/analyze", response_model=AnalysisResponse, response_class=ORJSONResponse)
 async def analyze_image(
     file: UploadFile = File(...),
     detector_conf: float = Form(0.25),
@@ -171,81 +219,114 @@ async def analyze_image(
         Analysis results with findings and bounding boxes
     """
     start_time = time.time()
+    image_bytes = await file.read()
     
+    return await _analyze(
+        image_bytes, detector_conf, detector_iou, detector_max_boxes, calibration_enabled, start_time
+    )
+
+
+@app.post("/analyze_raw", response_model=AnalysisResponse, response_class=ORJSONResponse)
+async def analyze_image_raw(
+    request: Request,
+    detector_conf: float = 0.25,
+    detector_iou: float = 0.45,
+    detector_max_boxes: int = 10,
+    calibration_enabled: str = "true"
+):
+    """
+    Analyze a chest X-ray image sent as the raw request body.
+    
+    Same as /analyze, but skips multipart framing: the body is the image
+    itself and the options are query parameters.
+    
+    Returns:
+        Analysis results with findings and bounding boxes
+    """
+    start_time = time.time()
+    image_bytes = await request.body()
+    
+    return await _analyze(
+        image_bytes, detector_conf, detector_iou, detector_max_boxes, calibration_enabled, start_time
+    )
+
+
+async def _analyze(
+    image_bytes: bytes,
+    detector_conf: float,
+    detector_iou: float,
+    detector_max_boxes: int,
+    calibration_enabled: str,
+    start_time: float
+) -> ORJSONResponse:
+    """Run the models on an uploaded image and build the analysis response."""
     # Parse calibration flag
     calibrate = calibration_enabled.lower() == "true"
     
     # Read image
     try:
-        image_bytes = await file.read()
-        image = Image.open(io.BytesIO(image_bytes))
+        # Decoding a large PNG/JPEG would otherwise block the event loop
+        image = await asyncio.to_thread(_decode, image_bytes)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to read image: {e}")
     
+    # Results stay plain dicts: ORJSONResponse serializes them directly,
+    # so AnalysisResponse only documents the schema
     findings = []
     bounding_boxes = []
     
     # Run classifier
     if classifier and classifier.loaded:
         try:
-            classifier_results = classifier.predict(image, calibrate=calibrate)
+            classifier_results = await classifier_batcher.submit(image, calibrate=calibrate)
             
-            for finding_name, probs in classifier_results.items():
-                findings.append(FindingResult(
-                    name=finding_name,
-                    probability=probs["probability"],
-                    calibrated_probability=probs["calibrated_probability"]
-                ))
+            findings = [
+                {
+                    "name": finding_name,
+                    "probability": probs["probability"],
+                    "calibrated_probability": probs["calibrated_probability"]
+                }
+                for finding_name, probs in classifier_results.items()
+            ]
         except Exception as e:
             print(f"Classifier error: {e}")
     
+    # Skip localization when the classifier sees nothing worth localizing
+    run_detector = should_run_detector(findings, settings.detector_gate_threshold)
+    if not run_detector:
+        print(f"Skipping detector: no finding reaches gate {settings.detector_gate_threshold}")
+    
     # Run detector
-    if detector and detector.loaded:
+    if detector and detector.loaded and run_detector:
         try:
-            detector_results = detector.predict(
+            # Both detectors already return BoundingBoxResult-shaped dicts
+            bounding_boxes = await detector_batcher.submit(
                 image,
                 conf_threshold=detector_conf,
                 iou_threshold=detector_iou,
                 max_boxes=detector_max_boxes
             )
-            
-            for det in detector_results:
-                bounding_boxes.append(BoundingBoxResult(
-                    name=det["name"],
-                    confidence=det["confidence"],
-                    x_min=det["x_min"],
-                    y_min=det["y_min"],
-                    x_max=det["x_max"],
-                    y_max=det["y_max"],
-                    x_min_px=det.get("x_min_px"),
-                    y_min_px=det.get("y_min_px"),
-                    x_max_px=det.get("x_max_px"),
-                    y_max_px=det.get("y_max_px")
-                ))
         except Exception as e:
             print(f"Detector error: {e}")
     
     processing_time_ms = int((time.time() - start_time) * 1000)
     
     # Build model info
-    model_info = {
-        "classifier": classifier.get_info() if classifier else None,
-        "detector": detector.get_info() if detector else None,
-        "calibration_enabled": calibrate
-    }
+    model_info = {**model_info_base, "calibration_enabled": calibrate}
     
-    return AnalysisResponse(
-        findings=findings,
-        bounding_boxes=bounding_boxes,
-        processing_time_ms=processing_time_ms,
-        model_info=model_info
-    )
+    return ORJSONResponse({
+        "findings": findings,
+        "bounding_boxes": bounding_boxes,
+        "processing_time_ms": processing_time_ms,
+        "model_info": model_info
+    })
 
 
 @app.post("/reload")
 async def reload_models():
     """Reload models (admin endpoint)."""
-    load_models()
+    # Same thread as startup; this also waits out any detector batch in flight
+    await detector_batcher.run_in_thread(load_models)
     return {"status": "reloaded", "models_loaded": models_loaded}
 
 
@@ -0,0 +1,114 @@
+"""
+ONNX export and ONNX Runtime session helpers shared by the models.
+"""
+import hashlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+    print("Warning: onnxruntime not available")
+
+
+def weights_digest(model: nn.Module) -> str:
+    """Short SHA-256 digest of a model's weights, used to key exported files."""
+    sha256 = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        sha256.update(name.encode())
+        sha256.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return sha256.hexdigest()[:16]
+
+
+def get_providers(device: str) -> List[str]:
+    """
+    ONNX Runtime execution providers for the given device, best first.
+    
+    Raises:
+        RuntimeError: If the device is CUDA but the CUDA provider isn't
+            available; the callers then keep the PyTorch CUDA path
+            rather than silently serving from the CPU
+    """
+    available = ort.get_available_providers()
+    if str(device).startswith("cuda"):
+        if "CUDAExecutionProvider" not in available:
+            raise RuntimeError(
+                f"CUDAExecutionProvider not available (have {', '.join(available)})"
+            )
+        return ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    return ["CPUExecutionProvider"]
+
+
+def export_onnx(
+    model: nn.Module,
+    args: Tuple,
+    path: Path,
+    input_names: List[str],
+    output_names: List[str],
+    dynamic_axes: Optional[Dict[str, Dict[int, str]]] = None,
+    opset_version: int = 14
+) -> Path:
+    """Export a model to ONNX at ``path`` unless it is already there."""
+    if path.exists():
+        return path
+    
+    print(f"Exporting ONNX model to {path}...")
+    tmp_path = path.with_suffix(".onnx.tmp")
+    torch.onnx.export(
+        model,
+        args,
+        str(tmp_path),
+        opset_version=opset_version,
+        input_names=input_names,
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
+    )
+    tmp_path.replace(path)
+    return path
+
+
+def create_session(path: Path, device: str) -> "ort.InferenceSession":
+    """Open an ONNX Runtime session with full graph optimizations."""
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(
+        str(path), sess_options=options, providers=get_providers(device)
+    )
+    print(f"ONNX Runtime session ready ({session.get_providers()[0]})")
+    return session
+
+
+def quantize_onnx(
+    fp32_path: Path,
+    int8_path: Path,
+    calibration_inputs: List[Dict[str, np.ndarray]]
+) -> Path:
+    """Statically quantize an ONNX model to INT8 (QDQ) using sample inputs."""
+    from onnxruntime.quantization import (
+        CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    )
+    
+    class _SampleReader(CalibrationDataReader):
+        def __init__(self, samples: List[Dict[str, np.ndarray]]):
+            self._samples = iter(samples)
+        
+        def get_next(self) -> Optional[Dict[str, np.ndarray]]:
+            return next(self._samples, None)
+    
+    tmp_path = int8_path.with_suffix(".onnx.tmp")
+    quantize_static(
+        str(fp32_path),
+        str(tmp_path),
+        _SampleReader(calibration_inputs),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    tmp_path.replace(int8_path)
+    return int8_path
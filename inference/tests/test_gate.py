@@ -0,0 +1,31 @@
+"""
+Tests for the classifier gate in front of the detector.
+"""
+from app.gate import should_run_detector
+
+
+def _findings(*probabilities):
+    return [
+        {"name": f"finding_{i}", "probability": p, "calibrated_probability": p}
+        for i, p in enumerate(probabilities)
+    ]
+
+
+def test_runs_at_threshold():
+    assert should_run_detector(_findings(0.05, 0.15), 0.15)
+
+
+def test_runs_above_threshold():
+    assert should_run_detector(_findings(0.01, 0.6), 0.15)
+
+
+def test_skips_below_threshold():
+    assert not should_run_detector(_findings(0.05, 0.149), 0.15)
+
+
+def test_runs_without_findings():
+    assert should_run_detector([], 0.15)
+
+
+def test_zero_threshold_disables_gate():
+    assert should_run_detector(_findings(0.0, 0.0), 0.0)
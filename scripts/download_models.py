@@ -4,12 +4,23 @@ Script to download pretrained models for CXR Triage system.
 """
 import os
 import sys
+import asyncio
 import urllib.request
 import hashlib
 from pathlib import Path
+from typing import List, Optional, Tuple
+
+try:
+    import httpx
+    HTTPX_AVAILABLE = True
+except ImportError:
+    HTTPX_AVAILABLE = False
 
 MODELS_DIR = Path(__file__).parent.parent / "models"
 
+# Parallel range requests per file
+DOWNLOAD_CONNECTIONS = 8
+
 # Model definitions
 MODELS = {
     "densenet121-res224-all": {
@@ -68,17 +79,139 @@ def download_file(url: str, dest_path: Path, description: str = ""):
             dest_path.unlink()
         return False
 
-def verify_checksum(filepath: Path, expected_hash: str) -> bool:
-    """Verify file checksum (partial match)."""
-    if not expected_hash:
-        return True
+async def _download_range(client, url: str, fd: int, start: int, end: int):
+    """Stream bytes [start, end] of url into fd at the matching offset."""
+    headers = {"Range": f"bytes={start}-{end}"}
+    async with client.stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise RuntimeError(f"server ignored range request (HTTP {response.status_code})")
+        offset = start
+        async for chunk in response.aiter_bytes():
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+
+async def _download_ranges(client, url: str, fd: int, total_size: int):
+    """
+    Fill fd with url's bytes using DOWNLOAD_CONNECTIONS concurrent ranges.
+    
+    Every range task has finished (or been cancelled) by the time this
+    returns or raises, so none can write to fd after the caller closes it.
+    """
+    chunk_size = -(-total_size // DOWNLOAD_CONNECTIONS)
+    tasks = [
+        asyncio.ensure_future(
+            _download_range(client, url, fd, start, min(start + chunk_size, total_size) - 1)
+        )
+        for start in range(0, total_size, chunk_size)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def download_file_async(
+    client, url: str, dest_path: Path, description: str = ""
+) -> Tuple[bool, Optional[str]]:
+    """
+    Download a file using parallel HTTP range requests when supported.
+    
+    Returns:
+        Tuple of (success, sha256 hex digest if it was computed while
+        streaming, else None)
+    """
+    if dest_path.exists():
+        print(f"{dest_path.name}: already exists, skipping...")
+        return True, None
+    
+    print(f"Downloading: {description or url}")
+    part_path = dest_path.with_suffix(dest_path.suffix + ".part")
     
-    sha256 = hashlib.sha256()
+    digest = None
+    try:
+        try:
+            head = await client.head(url)
+            head.raise_for_status()
+            total_size = int(head.headers.get("content-length", 0))
+            supports_ranges = head.headers.get("accept-ranges", "").lower() == "bytes"
+        except (httpx.HTTPError, ValueError) as e:
+            # Some hosts reject HEAD; a plain GET still works
+            print(f"{dest_path.name}: HEAD failed ({e}), using a single stream")
+            total_size = 0
+            supports_ranges = False
+        
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if supports_ranges and total_size > 0:
+                # Preallocate, then fill disjoint ranges concurrently
+                os.ftruncate(fd, total_size)
+                await _download_ranges(client, url, fd, total_size)
+            else:
+                # Single stream: hash in the same pass as the write
+                sha256 = hashlib.sha256()
+                async with client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes():
+                        os.write(fd, chunk)
+                        sha256.update(chunk)
+                digest = sha256.hexdigest()
+        finally:
+            os.close(fd)
+        
+        part_path.replace(dest_path)
+        print(f"{dest_path.name}: download complete ({dest_path.stat().st_size / 1024 / 1024:.1f} MB)")
+        return True, digest
+    except Exception as e:
+        print(f"{dest_path.name}: error downloading: {e}")
+        if part_path.exists():
+            part_path.unlink()
+        return False, None
+
+async def download_all(model_names: List[str]) -> List[Tuple[bool, Optional[str]]]:
+    """Download several models concurrently over a shared client."""
+    limits = httpx.Limits(max_connections=DOWNLOAD_CONNECTIONS * len(model_names))
+    async with httpx.AsyncClient(
+        # HTTP/1.1 on purpose: over HTTP/2 httpx multiplexes every range
+        # request to a host onto one TCP connection, which defeats the
+        # per-connection parallelism the ranged download relies on
+        http2=False,
+        follow_redirects=True,
+        timeout=httpx.Timeout(60.0, connect=30.0),
+        limits=limits
+    ) as client:
+        return await asyncio.gather(*[
+            download_file_async(
+                client,
+                MODELS[name]["url"],
+                MODELS_DIR / MODELS[name]["filename"],
+                MODELS[name]["description"]
+            )
+            for name in model_names
+        ])
+
+def file_sha256(filepath: Path) -> str:
+    """SHA-256 hex digest of a file."""
     with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            sha256.update(chunk)
+        if hasattr(hashlib, "file_digest"):
+            # Python 3.11+: streams through OpenSSL with the GIL released
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        
+        sha256 = hashlib.sha256()
+        buf = bytearray(1024 * 1024)
+        view = memoryview(buf)
+        while n := f.readinto(buf):
+            sha256.update(view[:n])
+        return sha256.hexdigest()
+
+def verify_checksum(filepath: Path, expected_hash: str, actual_hash: Optional[str] = None) -> bool:
+    """Verify file checksum (partial match), reusing a digest computed during download."""
+    if not expected_hash:
+        return True
     
-    actual_hash = sha256.hexdigest()
+    if actual_hash is None:
+        actual_hash = file_sha256(filepath)
     return expected_hash in actual_hash
 
 def main():
@@ -102,17 +235,26 @@ def main():
     if "--all" in sys.argv:
         models_to_download = list(MODELS.keys())
     
-    for model_name in models_to_download:
+    if HTTPX_AVAILABLE:
+        downloaded = asyncio.run(download_all(models_to_download))
+    else:
+        # Fall back to sequential stdlib downloads
+        downloaded = [
+            (download_file(
+                MODELS[name]["url"],
+                MODELS_DIR / MODELS[name]["filename"],
+                MODELS[name]["description"]
+            ), None)
+            for name in models_to_download
+        ]
+    
+    for model_name, (ok, digest) in zip(models_to_download, downloaded):
         model_info = MODELS[model_name]
         dest_path = MODELS_DIR / model_info["filename"]
         
-        if download_file(
-            model_info["url"],
-            dest_path,
-            model_info["description"]
-        ):
+        if ok:
             if model_info.get("sha256"):
-                if verify_checksum(dest_path, model_info["sha256"]):
+                if verify_checksum(dest_path, model_info["sha256"], digest):
                     print("Checksum verified!")
                     success_count += 1
                 else:
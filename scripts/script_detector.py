@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Script to export the CXR detector as a TorchScript module.
+
+The inference service loads models/detector_scripted.pt in place of the
+eager Faster R-CNN when it exists.
+"""
+import sys
+from pathlib import Path
+
+import torch
+from torchvision.models.detection import fasterrcnn_resnet50_fpn, FasterRCNN_ResNet50_FPN_Weights
+from torchvision.models.detection.faster_rcnn import FastRCNNPredictor
+
+MODELS_DIR = Path(__file__).parent.parent / "models"
+
+# Must match DETECTOR_CLASS_MAPPING in inference/app/config.py (+1 for background)
+NUM_CLASSES = 7
+
+def build_model() -> torch.nn.Module:
+    """Build the detector exactly as the inference service does."""
+    weights_path = MODELS_DIR / "detector_weights.pth"
+    
+    if weights_path.exists():
+        model = fasterrcnn_resnet50_fpn(weights=None, weights_backbone=None)
+    else:
+        model = fasterrcnn_resnet50_fpn(weights=FasterRCNN_ResNet50_FPN_Weights.DEFAULT)
+    
+    in_features = model.roi_heads.box_predictor.cls_score.in_features
+    model.roi_heads.box_predictor = FastRCNNPredictor(in_features, NUM_CLASSES)
+    
+    if weights_path.exists():
+        model.load_state_dict(torch.load(weights_path, map_location="cpu"))
+        print(f"Loaded custom weights from {weights_path}")
+    else:
+        print("Using pretrained Faster R-CNN backbone (no custom CXR weights)")
+    
+    return model.eval()
+
+def main():
+    """Script the detector and save it to the models directory."""
+    MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    output_path = MODELS_DIR / "detector_scripted.pt"
+    
+    model = build_model()
+    scripted = torch.jit.script(model)
+    scripted.save(str(output_path))
+    
+    size_mb = output_path.stat().st_size / (1024 * 1024)
+    print(f"Saved scripted detector to {output_path} ({size_mb:.1f} MB)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
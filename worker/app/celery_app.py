@@ -26,14 +26,28 @@ celery_app.conf.update(
     task_time_limit=300,  # 5 minutes
     task_soft_time_limit=240,  # 4 minutes
     worker_prefetch_multiplier=1,
-    worker_concurrency=2,
 )
 
 # Task routes
+# Each queue gets its own worker with a pool suited to the work:
+#   analysis   - waits on the inference service over HTTP (I/O-bound):
+#                celery -A app.celery_app worker -Q analysis --pool=gevent -c 50
+#   conversion - DICOM decode and PNG encode (CPU-bound):
+#                celery -A app.celery_app worker -Q conversion --pool=prefork -c 4
 celery_app.conf.task_routes = {
     "app.tasks.analyze_study": {"queue": "analysis"},
     "app.tasks.convert_dicom": {"queue": "conversion"},
 }
 
+# Under the gevent pool, let psycopg2 yield to other greenlets while it
+# waits on the database instead of blocking the whole process
+try:
+    from gevent import monkey
+    if monkey.is_module_patched("socket"):
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+except ImportError:
+    pass
+
 if __name__ == "__main__":
     celery_app.start()
@@ -2,12 +2,19 @@
 Celery tasks for async processing.
 """
 import os
+import functools
 import time
 import json
 from datetime import datetime
-from typing import Dict, Any
+from types import MappingProxyType
+from typing import Dict, Any, Iterable, Mapping, Tuple
+import threading
 import httpx
-from sqlalchemy import create_engine
+import numpy as np
+import orjson
+from celery import group
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+from sqlalchemy import create_engine, insert, update
 from sqlalchemy.orm import sessionmaker
 
 from app.celery_app import celery_app
@@ -19,9 +26,93 @@ DATABASE_URL = os.getenv(
 )
 INFERENCE_URL = os.getenv("INFERENCE_SERVICE_URL", "http://inference:8001")
 
-engine = create_engine(DATABASE_URL)
+
+def _json_dumps(value: Any) -> str:
+    """Serialize JSON column values (audit details, triage reasons) with orjson."""
+    return orjson.dumps(value).decode()
+
+
+def _make_engine():
+    """Create the database engine with a pre-pinged connection pool."""
+    return create_engine(
+        DATABASE_URL,
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        insertmanyvalues_page_size=1000,
+        executemany_mode="values_plus_batch",
+        json_serializer=_json_dumps,
+        # Fail fast on stalled queries and never sit idle inside a transaction
+        connect_args={
+            "options": "-c statement_timeout=30000 -c idle_in_transaction_session_timeout=5000"
+        }
+    )
+
+
+engine = _make_engine()
 SessionLocal = sessionmaker(bind=engine)
 
+# Shared HTTP client for the inference service (keep-alive connection pool)
+_client: httpx.Client = None
+_client_lock = threading.Lock()
+
+
+def _make_client() -> httpx.Client:
+    """Create a pooled HTTP client for the inference service."""
+    return httpx.Client(
+        base_url=INFERENCE_URL,
+        limits=httpx.Limits(
+            max_keepalive_connections=20, max_connections=100, keepalive_expiry=60.0
+        ),
+        http2=True,
+        timeout=120.0
+    )
+
+
+def get_client() -> httpx.Client:
+    """Get the process-wide inference client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _make_client()
+    return _client
+
+
+@worker_process_init.connect
+def _init_client(**kwargs):
+    """Give each forked worker process its own connection pool."""
+    global _client
+    _client = _make_client()
+
+
+@worker_process_init.connect
+def _init_engine(**kwargs):
+    """Drop connections inherited from the parent and give this process its own pool."""
+    global engine
+    # close=False leaves the parent's sockets alone; closing them here would break it
+    engine.dispose(close=False)
+    engine = _make_engine()
+    SessionLocal.configure(bind=engine)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _dispose_engine(**kwargs):
+    """Close pooled database connections on shutdown."""
+    engine.dispose()
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _close_client(**kwargs):
+    """Close pooled inference connections on shutdown."""
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
 
 @celery_app.task(bind=True, max_retries=3)
 def analyze_study(self, study_id: str, image_path: str, settings: Dict[str, Any]):
@@ -35,99 +126,108 @@ def analyze_study(self, study_id: str, image_path: str, settings: Dict[str, Any]
     """
     from app.models import Study, Finding, BoundingBox, AuditLog
     
-    session = SessionLocal()
-    
     try:
-        # Update status
-        study = session.query(Study).filter(Study.id == study_id).first()
-        if not study:
+        # T1: publish the processing status on a short autocommit connection
+        with engine.begin() as conn:
+            updated = conn.execute(
+                update(Study).where(Study.id == study_id).values(status="processing")
+            ).rowcount
+        if not updated:
             raise ValueError(f"Study {study_id} not found")
         
-        study.status = "processing"
-        session.commit()
-        
         start_time = time.time()
         
-        # Call inference service
-        with open(image_path, "rb") as f:
-            files = {"file": (os.path.basename(image_path), f, "image/png")}
-            data = {
-                "detector_conf": str(settings.get("detector_confidence", 0.25)),
-                "detector_iou": str(settings.get("detector_iou", 0.45)),
-                "detector_max_boxes": str(settings.get("detector_max_boxes", 10)),
-                "calibration_enabled": str(settings.get("calibration_enabled", True)).lower()
-            }
-            
-            response = httpx.post(
-                f"{INFERENCE_URL}/analyze",
-                files=files,
-                data=data,
-                timeout=120.0
-            )
-            response.raise_for_status()
-            result = response.json()
+        # Call inference service (no database connection is held meanwhile).
+        # The image goes up as the raw body, with options in the query string,
+        # so there is no multipart encoding on either side.
+        image_bytes = _read_once(image_path)
+        params = _build_inference_data(
+            settings.get("detector_confidence", 0.25),
+            settings.get("detector_iou", 0.45),
+            settings.get("detector_max_boxes", 10),
+            settings.get("calibration_enabled", True)
+        )
         
-        # Process findings
-        findings_data = result.get("findings", [])
-        for f in findings_data:
-            finding = Finding(
-                study_id=study_id,
-                finding_name=f["name"],
-                probability=f["probability"],
-                calibrated_probability=f["calibrated_probability"],
-                status=determine_status(f, settings)
-            )
-            session.add(finding)
+        response = get_client().post(
+            "/analyze_raw",
+            params=params,
+            content=image_bytes,
+            headers={"Content-Type": "image/png"}
+        )
+        response.raise_for_status()
+        result = orjson.loads(response.content)
         
-        # Process bounding boxes
+        findings_data = result.get("findings", [])
         boxes_data = result.get("bounding_boxes", [])
-        for b in boxes_data:
-            box = BoundingBox(
-                study_id=study_id,
-                finding_name=b["name"],
-                confidence=b["confidence"],
-                x_min=b["x_min"],
-                y_min=b["y_min"],
-                x_max=b["x_max"],
-                y_max=b["y_max"],
-                x_min_px=b.get("x_min_px"),
-                y_min_px=b.get("y_min_px"),
-                x_max_px=b.get("x_max_px"),
-                y_max_px=b.get("y_max_px")
-            )
-            session.add(box)
-        
-        # Determine triage level
-        triage_level, triage_reasons = determine_triage(findings_data, settings)
+        statuses = classify_findings(findings_data, settings)
         
-        # Generate report
-        report_findings, report_impression = generate_report(findings_data, settings)
+        # Determine triage level and generate report
+        triage_level, triage_reasons, report_findings, report_impression = (
+            build_triage_and_report(findings_data, statuses)
+        )
         
-        # Update study
         processing_time_ms = int((time.time() - start_time) * 1000)
         
-        study.status = "completed"
-        study.triage_level = triage_level
-        study.triage_reasons = triage_reasons
-        study.report_findings = report_findings
-        study.report_impression = report_impression
-        study.processed_at = datetime.utcnow()
-        study.processing_time_ms = processing_time_ms
-        
-        # Audit log
-        audit = AuditLog(
-            study_id=study_id,
-            action="analysis_complete",
-            details={
-                "triage_level": triage_level,
-                "processing_time_ms": processing_time_ms,
-                "findings_count": len(findings_data),
-                "boxes_count": len(boxes_data)
-            }
-        )
-        session.add(audit)
-        
-        session.commit()
+        # T2: write all results in one transaction, opened only now
+        with SessionLocal() as session, session.begin():
+            # Process findings (one multi-row INSERT rather than a flush per row)
+            if findings_data:
+                session.execute(insert(Finding), [
+                    {
+                        "study_id": study_id,
+                        "finding_name": f["name"],
+                        "probability": f["probability"],
+                        "calibrated_probability": f["calibrated_probability"],
+                        "status": status
+                    }
+                    for f, status in zip(findings_data, statuses)
+                ])
+            
+            # Process bounding boxes
+            if boxes_data:
+                session.execute(insert(BoundingBox), [
+                    {
+                        "study_id": study_id,
+                        "finding_name": b["name"],
+                        "confidence": b["confidence"],
+                        "x_min": b["x_min"],
+                        "y_min": b["y_min"],
+                        "x_max": b["x_max"],
+                        "y_max": b["y_max"],
+                        "x_min_px": b.get("x_min_px"),
+                        "y_min_px": b.get("y_min_px"),
+                        "x_max_px": b.get("x_max_px"),
+                        "y_max_px": b.get("y_max_px")
+                    }
+                    for b in boxes_data
+                ])
+            
+            # Update study
+            session.execute(
+                update(Study)
+                .where(Study.id == study_id)
+                .values(
+                    status="completed",
+                    triage_level=triage_level,
+                    triage_reasons=triage_reasons,
+                    report_findings=report_findings,
+                    report_impression=report_impression,
+                    processed_at=datetime.utcnow(),
+                    processing_time_ms=processing_time_ms
+                )
+            )
+            
+            # Audit log
+            session.add(AuditLog(
+                study_id=study_id,
+                action="analysis_complete",
+                details={
+                    "triage_level": triage_level,
+                    "processing_time_ms": processing_time_ms,
+                    "findings_count": len(findings_data),
+                    "boxes_count": len(boxes_data)
+                }
+            ))
         
         return {
             "study_id": study_id,
@@ -137,20 +237,76 @@ def analyze_study(self, study_id: str, image_path: str, settings: Dict[str, Any]
         }
         
     except Exception as e:
-        session.rollback()
-        
-        # Update study with error
-        study = session.query(Study).filter(Study.id == study_id).first()
-        if study:
-            study.status = "failed"
-            study.error_message = str(e)
-            session.commit()
+        # Update study with error (a missing study simply matches no rows)
+        with engine.begin() as conn:
+            conn.execute(
+                update(Study)
+                .where(Study.id == study_id)
+                .values(status="failed", error_message=str(e)[:1024])
+            )
         
         # Retry or fail
         raise self.retry(exc=e, countdown=30)
-    
+
+
+def _drop_page_cache(fd: int):
+    """Tell the kernel a file's cached pages won't be needed again (no-op where unsupported)."""
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _read_once(path: str) -> bytes:
+    """Read a whole file that won't be read again, without leaving it in the page cache."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        chunks = []
+        while size > 0:
+            chunk = os.read(fd, size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        _drop_page_cache(fd)
+        return b"".join(chunks)
     finally:
-        session.close()
+        os.close(fd)
+
+
+@functools.lru_cache(maxsize=128, typed=True)
+def _build_inference_data(
+    detector_conf: float,
+    detector_iou: float,
+    detector_max_boxes: int,
+    calibration_enabled: bool
+) -> Mapping[str, str]:
+    """
+    Query parameters for /analyze_raw, cached since a few settings profiles cover most tasks.
+    
+    Typed so that True/1 or 10/10.0 don't share an entry: their str() forms differ.
+    """
+    return MappingProxyType({
+        "detector_conf": str(detector_conf),
+        "detector_iou": str(detector_iou),
+        "detector_max_boxes": str(detector_max_boxes),
+        "calibration_enabled": str(calibration_enabled).lower()
+    })
+
+
+def enqueue_studies(studies: Iterable[Tuple[str, str, Dict[str, Any]]]):
+    """
+    Queue analysis for several studies in one broker publish.
+    
+    Args:
+        studies: (study_id, image_path, settings) tuples
+    
+    Returns:
+        GroupResult for the queued tasks
+    """
+    return group(
+        analyze_study.s(study_id, image_path, settings)
+        for study_id, image_path, settings in studies
+    ).apply_async()
 
 
 @celery_app.task
@@ -166,29 +322,43 @@ def convert_dicom(dicom_path: str, output_path: str) -> Dict[str, Any]:
         Conversion result with metadata
     """
     import pydicom
-    from PIL import Image
+    from pydicom.pixel_data_handlers.util import apply_modality_lut, apply_voi_lut
+    import cv2
     import numpy as np
     
     try:
-        ds = pydicom.dcmread(dicom_path)
+        with open(dicom_path, "rb") as f:
+            ds = pydicom.dcmread(f)
+            # The source DICOM isn't read again; keep the page cache for hot files
+            _drop_page_cache(f.fileno())
         
-        # Get pixel array
-        pixel_array = ds.pixel_array.astype(float)
+        # Decode JPEG/JPEG-LS/JPEG 2000 pixel data with the C-backed pylibjpeg
+        # plugins, falling back to whatever handler pydicom picks
+        if ds.file_meta.TransferSyntaxUID.is_compressed:
+            try:
+                ds.decompress(handler_name="pylibjpeg")
+            except Exception:
+                ds.decompress()
         
-        # Normalize
-        pixel_min = pixel_array.min()
-        pixel_max = pixel_array.max()
-        if pixel_max > pixel_min:
-            pixel_array = (pixel_array - pixel_min) / (pixel_max - pixel_min) * 255
-        pixel_array = pixel_array.astype(np.uint8)
+        # Get pixel array in output units: rescale slope/intercept (or
+        # modality LUT), then the VOI LUT or WindowCenter/WindowWidth
+        raw = apply_voi_lut(apply_modality_lut(ds.pixel_array, ds), ds)
+        
+        # Min-max normalize to uint8 in one pass, without a float64 copy
+        pixel_array = np.empty(raw.shape, dtype=np.uint8)
+        cv2.normalize(raw, pixel_array, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
         
         # Handle MONOCHROME1
         if str(getattr(ds, "PhotometricInterpretation", "")) == "MONOCHROME1":
-            pixel_array = 255 - pixel_array
+            cv2.bitwise_not(pixel_array, dst=pixel_array)
+        
+        # pydicom gives color pixels as RGB; OpenCV writes channels as BGR
+        if pixel_array.ndim == 3:
+            pixel_array = cv2.cvtColor(pixel_array, cv2.COLOR_RGB2BGR)
         
-        # Save as PNG
-        image = Image.fromarray(pixel_array)
-        image.save(output_path, "PNG")
+        # Save as PNG; fast deflate (level 1) costs ~10-15% in file size
+        if not cv2.imwrite(output_path, pixel_array, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+            raise IOError(f"Failed to write {output_path}")
         
         # Extract metadata
         metadata = {
@@ -212,59 +382,73 @@ def convert_dicom(dicom_path: str, output_path: str) -> Dict[str, Any]:
         }
 
 
-def determine_status(finding: Dict, settings: Dict) -> str:
-    """Determine finding status based on thresholds."""
-    prob = finding.get("calibrated_probability", finding.get("probability", 0))
-    finding_name = finding.get("name", "").lower()
-    
-    # Get thresholds from settings
-    thresholds = settings.get("thresholds", {}).get(finding_name, {})
-    triage_threshold = thresholds.get("triage_threshold", 0.3)
-    strong_threshold = thresholds.get("strong_threshold", 0.7)
-    
-    if prob >= strong_threshold:
-        return "POSITIVE"
-    elif prob >= triage_threshold:
-        return "POSSIBLE"
-    elif prob >= triage_threshold * 0.7:
-        return "UNCERTAIN"
-    else:
-        return "NEG"
+# Shared read-only default for missing threshold settings
+_EMPTY: Dict = {}
 
+# Finding statuses, indexed by the codes classify_findings computes
+_LABELS = ("POSITIVE", "POSSIBLE", "UNCERTAIN", "NEG")
 
-def determine_triage(findings: list, settings: Dict) -> tuple:
-    """Determine triage level from findings."""
-    urgent_findings = []
-    routine_findings = []
+
+def classify_findings(findings: list, settings: Dict) -> list:
+    """
+    Determine the status of every finding from its configured thresholds.
     
-    for f in findings:
-        status = determine_status(f, settings)
-        if status == "POSITIVE":
-            urgent_findings.append(f["name"])
-        elif status in ["POSSIBLE", "UNCERTAIN"]:
-            routine_findings.append(f["name"])
+    POSITIVE at or above the strong threshold, POSSIBLE at or above the
+    triage threshold, UNCERTAIN at or above 0.7x the triage threshold,
+    NEG otherwise.
     
-    if urgent_findings:
-        return "URGENT", [f"High confidence {f} detected" for f in urgent_findings]
-    elif routine_findings:
-        return "ROUTINE", [f"Possible {f} detected" for f in routine_findings]
-    else:
-        return "NORMAL", ["No significant abnormalities detected"]
+    Args:
+        findings: Findings returned by the inference service
+        settings: Settings dict with per-finding thresholds
+        
+    Returns:
+        Status for each finding, in the same order
+    """
+    if not findings:
+        return []
+    
+    thresholds_all = settings.get("thresholds", _EMPTY)
+    thresholds = [thresholds_all.get(f.get("name", "").lower(), _EMPTY) for f in findings]
+    
+    probs = np.array([
+        f.get("calibrated_probability", f.get("probability", 0)) for f in findings
+    ], dtype=np.float64)
+    triage_thr = np.array([t.get("triage_threshold", 0.3) for t in thresholds], dtype=np.float64)
+    strong_thr = np.array([t.get("strong_threshold", 0.7) for t in thresholds], dtype=np.float64)
+    
+    codes = np.where(
+        probs >= strong_thr, 0,
+        np.where(probs >= triage_thr, 1, np.where(probs >= triage_thr * 0.7, 2, 3))
+    )
+    return [_LABELS[i] for i in codes.tolist()]
 
 
-def generate_report(findings: list, settings: Dict) -> tuple:
-    """Generate report text from findings."""
+def build_triage_and_report(findings: list, statuses: list) -> tuple:
+    """
+    Determine triage level and generate report text in one pass.
+    
+    Args:
+        findings: Findings returned by the inference service
+        statuses: Status of each finding, as computed by classify_findings
+    
+    Returns:
+        Tuple of (triage_level, triage_reasons, report_findings, report_impression)
+    """
+    urgent_findings = []
+    routine_findings = []
     findings_texts = []
     
-    for f in findings:
-        status = determine_status(f, settings)
+    for f, status in zip(findings, statuses):
         name = f["name"]
         
         if status == "POSITIVE":
+            urgent_findings.append(name)
             findings_texts.append(f"Findings suggestive of {name}.")
         elif status == "POSSIBLE":
+            routine_findings.append(name)
             findings_texts.append(f"Possible {name}. Clinical correlation recommended.")
         elif status == "UNCERTAIN":
+            routine_findings.append(name)
             findings_texts.append(f"Cannot exclude {name}. Radiologist review recommended.")
     
     if not findings_texts:
@@ -272,14 +456,17 @@ def generate_report(findings: list, settings: Dict) -> tuple:
     else:
         findings_text = " ".join(findings_texts)
     
-    # Generate impression
-    triage_level, reasons = determine_triage(findings, settings)
-    
-    if triage_level == "URGENT":
+    if urgent_findings:
+        triage_level = "URGENT"
+        reasons = [f"High confidence {f} detected" for f in urgent_findings]
         impression = f"URGENT: {', '.join(reasons)}. Immediate clinical attention recommended."
-    elif triage_level == "ROUTINE":
+    elif routine_findings:
+        triage_level = "ROUTINE"
+        reasons = [f"Possible {f} detected" for f in routine_findings]
         impression = f"Abnormal chest radiograph. {', '.join(reasons)}. Clinical correlation recommended."
     else:
+        triage_level = "NORMAL"
+        reasons = ["No significant abnormalities detected"]
         impression = "No acute cardiopulmonary abnormality identified."
     
-    return findings_text, impression
+    return triage_level, reasons, findings_text, impression